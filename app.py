@@ -1,6 +1,8 @@
 import os
 from flask import Flask
-from config import SECRET_KEY
+from config import SECRET_KEY, SCHEDULER_ENABLED
+from metrics import init_metrics
+from rendering import init_rendering
 from routes import register_routes
 
 app = Flask(__name__)
@@ -8,7 +10,13 @@ app.secret_key = SECRET_KEY
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+init_metrics(app)
+init_rendering(app)
 register_routes(app)
 
+if SCHEDULER_ENABLED:
+    from scheduler import start_scheduler
+    start_scheduler()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
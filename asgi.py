@@ -0,0 +1,204 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import sys
+from datetime import datetime
+from io import BytesIO
+from flask import Response, request, session, jsonify, redirect, url_for
+from flask_limiter.util import get_qualified_name
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from app import app as flask_app
+from async_fetch import fetcher
+from config import US_EASTERN, CRON_SECRET, PRICE_STREAM_MAX_SECONDS
+from metrics import span
+from models import load_holdings, load_stats, load_users
+from notifications import run_notifications
+from portfolio import value_portfolio
+from rendering import render_fragment
+from streaming import astream_prices
+from utils import news_cache, quote_cache
+
+CRON_DEADLINE = 15
+
+
+def _environ(scope, body=b''):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+# Storage reads are blocking file or SQLite I/O, so they run in threads; a slow disk then only holds up its own
+# request, not every request waiting on this loop.
+
+async def api_portfolio():
+    if 'user' not in session: return redirect(url_for('login'))
+    h, stats = await asyncio.gather(asyncio.to_thread(load_holdings, session['user']),
+                                    asyncio.to_thread(load_stats, session['user']))
+    symbols = list(dict.fromkeys(s['symbol'] for s in h))
+    with span('quotes'):
+        price_map = await fetcher.prices(symbols)
+    result = value_portfolio(h, stats, price_map, quote_cache.not_found(symbols))
+    result['as_of'] = datetime.now(US_EASTERN).isoformat(timespec='seconds')
+    return jsonify(result)
+
+
+async def api_news():
+    if 'user' not in session: return redirect(url_for('login'))
+    symbols = list(dict.fromkeys(s['symbol'] for s in await asyncio.to_thread(load_holdings, session['user'])))
+    with span('news'):
+        news, pending = await fetcher.news(symbols, wait=min(request.args.get('wait', 5, type=float), 10))
+    news = {sym: news[sym] for sym in symbols if sym in news}
+    html = render_fragment('news_panel.html', tuple(symbols), (news_cache.stamps(symbols), bool(pending)),
+                           news=news, pending=pending)
+    return jsonify({'news': news, 'pending': pending, 'html': html})
+
+
+async def api_stream():
+    # Streams wait on the shared poller without holding a thread, so open tabs never starve the thread pool.
+    if 'user' not in session: return redirect(url_for('login'))
+    h, stats = await asyncio.gather(asyncio.to_thread(load_holdings, session['user']),
+                                    asyncio.to_thread(load_stats, session['user']))
+    symbols = list(dict.fromkeys(s['symbol'] for s in h))
+
+    def render(prices):
+        result = value_portfolio(h, stats, prices, quote_cache.not_found(symbols))
+        result['as_of'] = datetime.now(US_EASTERN).isoformat(timespec='seconds')
+        return result
+
+    response = Response(mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.event_stream = astream_prices(symbols, render, PRICE_STREAM_MAX_SECONDS)
+    return response
+
+
+async def cron_trigger():
+    if request.args.get("secret") != CRON_SECRET:
+        return "Unauthorized", 401
+    # The pipeline holds a file lock and touches disk, so it runs in one thread; its quote calls still go
+    # through the shared event loop.
+    loop = asyncio.get_running_loop()
+    report = await asyncio.to_thread(lambda: run_notifications(
+        load_users(), fetch=lambda symbols: fetcher.prices_blocking(symbols, loop, CRON_DEADLINE)))
+    return jsonify(report)
+
+
+def _check_view_limits(app):
+    # Flask-Limiter checks decorator limits (such as the per-user API budget) inside the wrapped Flask view, which
+    # the native views replace, so run the same check against the limits registered for that view.
+    name = get_qualified_name(app.view_functions[request.endpoint])
+    for limiter in app.extensions.get('limiter', ()):
+        limiter._check_request_limit(in_middleware=False, callable_name=name)
+
+
+ASYNC_VIEWS = {'api_stream': api_stream}
+if fetcher:
+    ASYNC_VIEWS.update({'api_portfolio': api_portfolio, 'api_news': api_news, 'cron_trigger': cron_trigger})
+
+
+class AsyncApp:
+    # Views that mostly wait on upstream calls run on the event loop; everything else goes to Flask in a thread.
+    def __init__(self, wsgi_app, views):
+        self.wsgi_app = wsgi_app
+        self.fallback = AsyncioWSGIMiddleware(wsgi_app)
+        self.views = {rule.rule: views[rule.endpoint] for rule in wsgi_app.url_map.iter_rules()
+                      if rule.endpoint in views}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        view = self.views.get(scope.get('path')) if scope['type'] == 'http' else None
+        if view is None or scope['method'] not in ('GET', 'HEAD'):
+            return await self.fallback(scope, receive, send)
+        response = await self.dispatch(view, scope)
+        events = getattr(response, 'event_stream', None)
+        headers = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in response.headers.items()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        if events is not None and scope['method'] != 'HEAD':
+            await self.stream(events, receive, send)
+        else:
+            if events is not None: await events.aclose()
+            await send({'type': 'http.response.body',
+                        'body': b'' if scope['method'] == 'HEAD' else response.get_data()})
+
+    async def stream(self, events, receive, send):
+        # Stops as soon as the client disconnects, not at the next heartbeat, so the subscription is released.
+        disconnect = asyncio.ensure_future(self.disconnected(receive))
+        try:
+            while True:
+                chunk = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait({chunk, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    chunk.cancel()
+                    await asyncio.gather(chunk, return_exceptions=True)
+                    return
+                try:
+                    data = chunk.result()
+                except StopAsyncIteration:
+                    break
+                await send({'type': 'http.response.body', 'body': data.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnect.cancel()
+            await events.aclose()
+
+    async def disconnected(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if fetcher: await fetcher.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, view, scope):
+        # Same request lifecycle as Flask.wsgi_app, so sessions, rate limits, metrics and compression still apply.
+        app = self.wsgi_app
+        ctx = app.request_context(_environ(scope))
+        error = None
+        try:
+            ctx.push()
+            try:
+                # The rate-limit check and the session and compression hooks block too. to_thread copies the context,
+                # so the request context stays active in the worker thread.
+                rv = await asyncio.to_thread(app.preprocess_request)
+                if rv is None:
+                    await asyncio.to_thread(_check_view_limits, app)
+                    rv = await view()
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            return await asyncio.to_thread(app.finalize_request, rv)
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+
+
+app = AsyncApp(flask_app, ASYNC_VIEWS)
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+from config import (YAHOO_QUERY1_URL, YAHOO_QUERY2_URL, QUOTE_BATCH_SIZE, HTTP_RETRIES,
+                    ASYNC_CONCURRENCY, ASYNC_DEADLINE)
+from http_client import DEFAULT_TIMEOUT, CircuitOpenError, breaker, failed_status
+from metrics import upstream_latency, upstream_errors
+from utils import (BROWSER_HEADERS, CHART_PARAMS, NO_DATA, quote_cache, news_cache, parse_spark, parse_chart,
+                   parse_news, spark_params)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class _LoopState:
+    def __init__(self, loop, concurrency, retries):
+        self.loop = loop
+        # The connection limit is the concurrency limit: extra calls queue for a free connection.
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, limits=limits, headers=BROWSER_HEADERS,
+                                        transport=httpx.AsyncHTTPTransport(retries=retries, limits=limits))
+        self.quotes = {}
+        self.news = {}
+
+
+class AsyncFetcher:
+    def __init__(self, concurrency=ASYNC_CONCURRENCY, deadline=ASYNC_DEADLINE, quote_url=YAHOO_QUERY1_URL,
+                 news_url=YAHOO_QUERY2_URL, chunk_size=QUOTE_BATCH_SIZE, retries=HTTP_RETRIES):
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.quote_url = quote_url.rstrip('/')
+        self.news_url = news_url.rstrip('/')
+        self.chunk_size = max(1, chunk_size)
+        self.retries = retries
+        self._state = None
+
+    def _loop_state(self):
+        # One client per event loop; hypercorn runs a single loop per worker.
+        loop = asyncio.get_running_loop()
+        if self._state is None or self._state.loop is not loop:
+            self._state = _LoopState(loop, self.concurrency, self.retries)
+        return self._state
+
+    async def request(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        # Shares the sync client's breaker, so an outage seen by either path fails fast in both.
+        if not breaker.allow(host):
+            upstream_errors.inc(host, 'circuit_open')
+            raise CircuitOpenError(f"Circuit open for {host}")
+        start = time.perf_counter()
+        try:
+            resp = await self._loop_state().client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            breaker.record(host, False)
+            kind = 'timeout' if isinstance(e, httpx.TimeoutException) else 'connection'
+            upstream_latency.observe(time.perf_counter() - start, host, kind)
+            upstream_errors.inc(host, kind)
+            raise
+        breaker.record(host, not failed_status(resp.status_code))
+        upstream_latency.observe(time.perf_counter() - start, host, f"{resp.status_code // 100}xx")
+        if failed_status(resp.status_code):
+            upstream_errors.inc(host, 'status')
+        return resp
+
+    async def fetch_batch(self, symbols):
+        try:
+            resp = await self.request('GET', f"{self.quote_url}/v7/finance/spark", params=spark_params(symbols))
+            if resp.status_code == 200:
+                return parse_spark(resp.json(), symbols)
+            print(f"Error batch price ({resp.status_code}) for {len(symbols)} symbols: {resp.text[:200]}")
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"Error batch price {','.join(symbols)}: {e}")
+        return {}
+
+    async def fetch_chart(self, symbol):
+        try:
+            resp = await self.request('GET', f"{self.quote_url}/v8/finance/chart/{symbol}", params=CHART_PARAMS)
+            if resp.status_code == 200:
+                return symbol, parse_chart(resp.json()) or NO_DATA
+            if resp.status_code == 404:
+                return symbol, NO_DATA
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"Error price {symbol}: {e}")
+        return symbol, None
+
+    async def fetch_news(self, symbol):
+        try:
+            resp = await self.request('GET', f"{self.news_url}/v1/finance/search",
+                                      params={'q': symbol, 'newsCount': 3})
+            if resp.status_code == 200:
+                return parse_news(resp.json())
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"News refresh error {symbol}: {e}")
+        return None
+
+    async def _load_quotes(self, symbols):
+        price_map = {}
+        chunks = [symbols[i:i + self.chunk_size] for i in range(0, len(symbols), self.chunk_size)]
+        for batch in await asyncio.gather(*(self.fetch_batch(chunk) for chunk in chunks)):
+            price_map.update(batch)
+        missing = [sym for sym in symbols if sym not in price_map]
+        for sym, data in await asyncio.gather(*(self.fetch_chart(sym) for sym in missing)):
+            if data is not None:
+                price_map[sym] = data
+        quote_cache.put_many(price_map)
+        return price_map
+
+    async def _load_news(self, symbol):
+        items = await self.fetch_news(symbol)
+        news_cache.put(symbol, items)
+        return items
+
+    def _join(self, inflight, keys, start):
+        # Concurrent requests for the same symbols share one upstream call.
+        tasks = {}
+        for key in keys:
+            task = inflight.get(key)
+            if task is None:
+                task = inflight[key] = asyncio.ensure_future(start(key))
+                task.add_done_callback(lambda t, key=key: inflight.pop(key, None))
+            tasks[key] = task
+        return tasks
+
+    async def prices(self, symbols, deadline=None):
+        result, missing = quote_cache.lookup(list(dict.fromkeys(symbols)))
+        if not missing: return result
+        state = self._loop_state()
+        owned = [sym for sym in missing if sym not in state.quotes]
+        if owned:
+            task = asyncio.ensure_future(self._load_quotes(owned))
+            for sym in owned:
+                state.quotes[sym] = task
+            task.add_done_callback(lambda t: [state.quotes.pop(sym, None) for sym in owned])
+        tasks = {sym: state.quotes[sym] for sym in missing}
+        # Tasks are not cancelled at the deadline, so late answers still land in the cache for the next request.
+        await asyncio.wait(set(tasks.values()), timeout=deadline or self.deadline)
+        for sym, task in tasks.items():
+            if task.done() and not task.cancelled() and not task.exception() and task.result().get(sym):
+                result[sym] = task.result()[sym]
+        result.update(quote_cache.last_known([sym for sym in missing if sym not in result]))
+        return result
+
+    async def news(self, symbols, wait=None):
+        news_map, due = news_cache.lookup(symbols)
+        state = self._loop_state()
+        # Stale symbols are refreshed in the background and served from cache meanwhile.
+        tasks = self._join(state.news, [sym for sym, _ in due], self._load_news)
+        missing = {sym: tasks[sym] for sym, new in due if new}
+        if wait and missing:
+            await asyncio.wait(set(missing.values()), timeout=min(wait, self.deadline))
+        pending = []
+        for sym, task in missing.items():
+            if not task.done():
+                pending.append(sym)
+            elif not task.cancelled() and task.result():
+                news_map[sym] = task.result()
+        return news_map, pending
+
+    async def aclose(self):
+        if self._state is not None:
+            await self._state.client.aclose()
+            self._state = None
+
+    def prices_blocking(self, symbols, loop, deadline=None):
+        # For sync code running in a worker thread while the loop serves other requests.
+        return asyncio.run_coroutine_threadsafe(self.prices(symbols, deadline), loop).result()
+
+
+fetcher = AsyncFetcher() if httpx else None
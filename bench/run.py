@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stub_server
+
+
+def percentiles(samples):
+    if not samples: return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {'count': len(ordered), 'p50_ms': pick(50), 'p90_ms': pick(90), 'p99_ms': pick(99),
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3), 'max_ms': round(ordered[-1] * 1000, 3)}
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def configure_env(args, stub):
+    # Everything the app reads at import time has to be in place before the first import below.
+    base = stub_server.base_url(stub)
+    os.environ.update({
+        'FLASK_DEBUG': '1', 'SECRET_KEY': 'bench', 'CRON_SECRET': 'bench', 'PUSHOVER_APP_TOKEN': 'bench',
+        'DATA_DIR': args.data_dir, 'STORAGE_BACKEND': args.backend, 'SCHEDULER_ENABLED': '0',
+        'YAHOO_QUERY1_URL': base, 'YAHOO_QUERY2_URL': base, 'PUSHOVER_API_URL': f"{base}/1/messages.json",
+        'HTTP_RETRIES': '0', 'NOTIFY_MAX_RETRIES': '0',
+    })
+
+
+def login(client, name):
+    with client.session_transaction() as sess:
+        sess['user'] = name
+
+
+def bench_dashboard(client, args, rng):
+    from synthetic import create_users
+    from utils import quote_cache
+    names = create_users(args.users, args.holdings, args.history, seed=args.seed, prefix='dash')
+    quote_cache.clear()
+    pages, api = [], []
+    for _ in range(args.requests):
+        login(client, rng.choice(names))
+        elapsed, resp = timed(lambda: client.get('/dashboard'))
+        assert resp.status_code == 200, resp.status_code
+        pages.append(elapsed)
+        elapsed, resp = timed(lambda: client.get('/api/portfolio'))
+        assert resp.status_code == 200, resp.status_code
+        api.append(elapsed)
+    return {'users': args.users, 'holdings': args.holdings, 'history_rows': args.history,
+            'dashboard': percentiles(pages), 'api_portfolio': percentiles(api)}
+
+
+def bench_trade(client, args):
+    from synthetic import create_users
+    from models import load_holdings
+    results = []
+    for size in args.trade_sizes:
+        name = create_users(1, args.holdings, size, seed=args.seed + size, prefix=f"trade{size}_")[0]
+        login(client, name)
+        symbol = load_holdings(name)[0]['symbol']
+        samples = []
+        for _ in range(args.trades):
+            elapsed, resp = timed(lambda: client.post('/trade', data={'action': 'buy', 'symbol': symbol,
+                                                                      'qty': '1', 'price': '100'}))
+            assert resp.status_code == 302, resp.status_code
+            samples.append(elapsed)
+        results.append({'history_rows': size, **percentiles(samples)})
+    return results
+
+
+def bench_export(client, args):
+    from synthetic import create_users
+    name = create_users(1, args.holdings, args.export_rows, seed=args.seed, prefix='export')[0]
+    login(client, name)
+    results = []
+    for fmt in ('csv', 'csv.gz', 'jsonl'):
+        tracemalloc.start()
+        start = time.perf_counter()
+        resp = client.get('/export_data', query_string={'format': fmt}, buffered=False)
+        size = sum(len(chunk) for chunk in resp.response)
+        resp.close()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({'format': fmt, 'history_rows': args.export_rows, 'bytes': size,
+                        'peak_alloc_bytes': peak, 'duration_ms': round(elapsed * 1000, 3)})
+    return results
+
+
+def bench_notify(args):
+    # Calls run_notifications directly at a fixed in-market slot so every synthetic user is due. The
+    # /cron/trigger route always uses the wall clock, so this measures the pipeline without the HTTP layer.
+    from synthetic import create_users
+    from config import US_EASTERN
+    from models import load_users
+    from notifications import run_notifications, NotifyState, dispatcher
+    from utils import quote_cache
+    now_et = US_EASTERN.localize(datetime(2024, 1, 3, 11, 5))
+    results = []
+    for count in args.notify_users:
+        prefix = f"notify{count}_"
+        create_users(count, args.holdings, min(args.history, 50), seed=args.seed + count, prefix=prefix,
+                     notify_freq='hourly')
+        users = {n: u for n, u in load_users().items() if n.startswith(prefix)}
+        quote_cache.clear()
+        state = NotifyState(os.path.join(args.data_dir, f"notify_state_{count}.json"))
+        elapsed, report = timed(lambda: run_notifications(users, now_et=now_et, state=state))
+        drained, drain_ok = timed(lambda: dispatcher.join(timeout=args.drain_timeout))
+        results.append({'users': count, 'duration_ms': round(elapsed * 1000, 3),
+                        'users_per_sec': round(count / elapsed, 1) if elapsed else None,
+                        'drain_ms': round(drained * 1000, 3), 'drained': drain_ok,
+                        'notified': report.get('notified_users'), 'failed': report.get('failed'),
+                        'timings_ms': report.get('timings_ms')})
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def flatten(data, prefix=''):
+    out = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            out.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            label = value.get('history_rows', value.get('users', i)) if isinstance(value, dict) else i
+            if isinstance(value, dict) and 'format' in value: label = value['format']
+            out.update(flatten(value, f"{prefix}{label}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        out[prefix[:-1]] = data
+    return out
+
+
+def compare(results, baseline, tolerance):
+    # Lower is better for latencies, durations and memory; only those are checked.
+    old, new = flatten(baseline.get('results', {})), flatten(results['results'])
+    regressions = []
+    for key, value in sorted(new.items()):
+        if not key.endswith(('_ms', '_bytes')) or key not in old or not old[key]: continue
+        change = (value - old[key]) / old[key] * 100
+        if change > tolerance:
+            regressions.append({'metric': key, 'baseline': old[key], 'current': value, 'change_pct': round(change, 1)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StockTracker benchmark suite (runs against local stub servers)")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--users', type=int, default=20, help="Synthetic users for the dashboard benchmark")
+    parser.add_argument('--holdings', type=int, default=20, help="Holdings per synthetic user")
+    parser.add_argument('--history', type=int, default=500, help="History rows per synthetic user")
+    parser.add_argument('--requests', type=int, default=200, help="Dashboard requests to time")
+    parser.add_argument('--trade-sizes', type=lambda v: [int(x) for x in v.split(',')], default=[100, 1000, 10000])
+    parser.add_argument('--trades', type=int, default=20, help="Trades to time per history size")
+    parser.add_argument('--export-rows', type=int, default=20000)
+    parser.add_argument('--notify-users', type=lambda v: [int(x) for x in v.split(',')], default=[10, 100, 500])
+    parser.add_argument('--drain-timeout', type=float, default=60)
+    parser.add_argument('--latency-ms', type=float, default=20, help="Stub server base latency")
+    parser.add_argument('--jitter-ms', type=float, default=10, help="Extra random stub latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of stub requests that fail")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='*', choices=('dashboard', 'trade', 'export', 'notify'))
+    parser.add_argument('--output', help="Results file (default: bench/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="Earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=20, help="Allowed slowdown in percent before failing")
+    args = parser.parse_args()
+
+    args.data_dir = tempfile.mkdtemp(prefix='stocktracker-bench-')
+    stub = stub_server.start(stub_server.StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.seed))
+    configure_env(args, stub)
+
+    from app import app
+    for limiter in app.extensions.get('limiter', ()):
+        limiter.enabled = False
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    only = set(args.only or ('dashboard', 'trade', 'export', 'notify'))
+
+    results = {}
+    try:
+        if 'dashboard' in only: results['dashboard'] = bench_dashboard(client, args, rng)
+        if 'trade' in only: results['trade'] = bench_trade(client, args)
+        if 'export' in only: results['export'] = bench_export(client, args)
+        if 'notify' in only: results['notify'] = bench_notify(args)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(args.data_dir, ignore_errors=True)
+
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'data_dir')}
+    report = {'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'git': git_revision(),
+                       'python': platform.python_version(), 'platform': platform.platform(), 'params': params,
+                       'stub_requests': dict(stub.config.counts)},
+              'results': results}
+
+    output = args.output or os.path.join(ROOT, 'bench', 'results', f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} (+{r['change_pct']}%)")
+        if regressions: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class StubConfig:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def delay(self):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+            fail = self.random.random() < self.error_rate
+        if self.latency_ms or extra:
+            time.sleep((self.latency_ms + extra) / 1000)
+        return fail
+
+    def count(self, endpoint):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+
+def _price(symbol):
+    return 50 + (sum(map(ord, symbol)) % 200)
+
+
+def _spark(symbols):
+    return {'spark': {'result': [{'symbol': s, 'response': _chart(s, {})['chart']['result']} for s in symbols],
+                      'error': None}}
+
+
+def _chart(symbol, query):
+    meta = {'regularMarketPrice': _price(symbol), 'previousClose': _price(symbol) * 0.99}
+    if 'period1' not in query:
+        return {'chart': {'result': [{'meta': meta}]}}
+    end = int(query.get('period2', [time.time()])[0]) // 86400
+    start = max(int(query['period1'][0]) // 86400, end - 3660)
+    days = [d for d in range(start, end + 1) if (d + 3) % 7 < 5]
+    closes = [_price(symbol) * (1 + 0.1 * ((d * 7919) % 97 - 48) / 48) for d in days]
+    return {'chart': {'result': [{'meta': meta, 'timestamp': [d * 86400 + 20 * 3600 for d in days],
+                                  'indicators': {'quote': [{'open': closes, 'high': closes, 'low': closes,
+                                                            'close': closes, 'volume': [1000] * len(days)}]}}]}}
+
+
+def _news(symbol):
+    return {'news': [{'title': f"{symbol} headline {i}", 'link': f"https://example.com/{symbol}/{i}",
+                      'publisher': 'Stub Wire', 'providerPublishTime': int(time.time()) - i * 3600}
+                     for i in range(3)]}
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/v7/finance/spark':
+                endpoint, body = 'spark', lambda: _spark(query.get('symbols', [''])[0].split(','))
+            elif url.path.startswith('/v8/finance/chart/'):
+                symbol = url.path.rsplit('/', 1)[1]
+                endpoint, body = 'chart', lambda: _chart(symbol, query)
+            elif url.path == '/v1/finance/search':
+                endpoint, body = 'search', lambda: _news(query.get('q', [''])[0])
+            else:
+                return self._send(404, {'error': 'not found'})
+            config.count(endpoint)
+            if config.delay():
+                return self._send(503, {'error': 'injected failure'})
+            self._send(200, body())
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if urlparse(self.path).path != '/1/messages.json':
+                return self._send(404, {'error': 'not found'})
+            config.count('pushover')
+            if config.delay():
+                return self._send(500, {'status': 0, 'errors': ['injected failure']})
+            self._send(200, {'status': 1, 'request': 'stub'})
+
+    return Handler
+
+
+def start(config=None, port=0):
+    config = config or StubConfig()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name='stub-server', daemon=True).start()
+    return server
+
+
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_port}"
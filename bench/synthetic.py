@@ -0,0 +1,63 @@
+import random
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'bench'
+_PASSWORD_HASH = None
+
+
+def symbols(count, rng):
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    pool = set()
+    while len(pool) < count:
+        pool.add(''.join(rng.choice(letters) for _ in range(rng.randint(2, 4))))
+    return sorted(pool)
+
+
+def history(holdings_count, rows, rng, universe, start=datetime(2015, 1, 2, 10, 0)):
+    # Replays random buys and sells with the same averaging rules as /trade, so holdings and history agree.
+    held = {}
+    txns = []
+    step = timedelta(minutes=max(1, (10 * 365 * 24 * 60) // max(rows, 1)))
+    when = start
+    picks = rng.sample(universe, min(holdings_count, len(universe)))
+    for i in range(rows):
+        when += step
+        sym = picks[i % len(picks)] if i < len(picks) else rng.choice(picks)
+        price = round(rng.uniform(20, 400), 2)
+        pos = held.get(sym)
+        if pos and pos['qty'] > 1 and rng.random() < 0.3:
+            qty = round(pos['qty'] * rng.uniform(0.1, 0.5), 4)
+            gain = (price - pos['priceBought']) * qty
+            pos['qty'] -= qty
+            txns.append({'date': when.strftime("%Y-%m-%d %H:%M"), 'type': 'SELL', 'symbol': sym, 'qty': qty,
+                         'price': price, 'realized_gain': gain})
+            continue
+        qty = round(rng.uniform(1, 50), 4)
+        if pos:
+            new_qty = pos['qty'] + qty
+            pos['priceBought'] = ((pos['qty'] * pos['priceBought']) + (qty * price)) / new_qty
+            pos['qty'] = new_qty
+        else:
+            held[sym] = {'symbol': sym, 'qty': qty, 'priceBought': price}
+        txns.append({'date': when.strftime("%Y-%m-%d %H:%M"), 'type': 'BUY', 'symbol': sym, 'qty': qty,
+                     'price': price, 'realized_gain': None})
+    return [p for p in held.values() if p['qty'] > 1e-6], txns
+
+
+def create_users(count, holdings_count, history_rows, seed=0, prefix='user', notify_freq='none', universe=None):
+    from models import edit_users, save_holdings, save_history
+    global _PASSWORD_HASH
+    if _PASSWORD_HASH is None:
+        _PASSWORD_HASH = generate_password_hash(PASSWORD)
+    rng = random.Random(seed)
+    universe = universe or symbols(max(holdings_count * 4, 50), rng)
+    names = [f"{prefix}{i}" for i in range(count)]
+    for name in names:
+        holdings, txns = history(holdings_count, history_rows, rng, universe)
+        save_holdings(name, holdings)
+        save_history(name, txns)
+    with edit_users() as users:
+        for name in names:
+            users[name] = {'hash': _PASSWORD_HASH, 'po_user': f"key-{name}", 'notify_freq': notify_freq}
+    return names
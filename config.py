@@ -5,6 +5,7 @@ from datetime import time as dtime
 SECRET_KEY = os.environ.get("SECRET_KEY")
 PUSHOVER_APP_TOKEN = os.environ.get("PUSHOVER_APP_TOKEN")
 CRON_SECRET = os.environ.get("CRON_SECRET")
+ADMIN_USERS = {u.strip() for u in os.environ.get("ADMIN_USERS", "").split(",") if u.strip()}
 
 if os.environ.get("FLASK_DEBUG") != '1':
     if not SECRET_KEY:
@@ -13,12 +14,65 @@ if os.environ.get("FLASK_DEBUG") != '1':
         raise ValueError("No CRON_SECRET set for cron endpoint")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = os.environ.get("DATA_DIR", os.path.join(BASE_DIR, "data"))
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(DATA_DIR, "stocktracker.db"))
+RATELIMIT_STORAGE_URI = os.environ.get("RATELIMIT_STORAGE_URI", f"sqlite:///{os.path.join(DATA_DIR, 'ratelimit.db')}")
+RATELIMIT_STRATEGY = os.environ.get("RATELIMIT_STRATEGY", "sliding-window-counter")
 
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
 MARKET_OPEN = dtime(9, 30)
 MARKET_CLOSE = dtime(16, 0)
-US_EASTERN = pytz.timezone('US/Eastern')
\ No newline at end of file
+US_EASTERN = pytz.timezone('US/Eastern')
+
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", 2048))
+QUOTE_TTL_OPEN = int(os.environ.get("QUOTE_TTL_OPEN", 30))
+QUOTE_TTL_CLOSED = int(os.environ.get("QUOTE_TTL_CLOSED", 900))
+QUOTE_NEGATIVE_TTL = int(os.environ.get("QUOTE_NEGATIVE_TTL", 3600))
+NEWS_TTL = int(os.environ.get("NEWS_TTL", 900))
+NEWS_CACHE_SIZE = int(os.environ.get("NEWS_CACHE_SIZE", 1024))
+PRICE_STREAM_INTERVAL = int(os.environ.get("PRICE_STREAM_INTERVAL", 30))
+PRICE_STREAM_MAX_SECONDS = int(os.environ.get("PRICE_STREAM_MAX_SECONDS", 300))
+PRICE_STREAM_THREADS = int(os.environ.get("PRICE_STREAM_THREADS", 2))
+# Per-user budget shared by the dashboard's JSON and stream endpoints. An open tab reconnects the stream every
+# PRICE_STREAM_MAX_SECONDS (12 an hour at 300) and polls news and history pages on top, far below this.
+API_RATE_LIMIT = os.environ.get("API_RATE_LIMIT", "1200 per hour")
+PRICE_HISTORY_YEARS = int(os.environ.get("PRICE_HISTORY_YEARS", 10))
+PRICE_REFRESH_RETRY = int(os.environ.get("PRICE_REFRESH_RETRY", 21600))
+VALUATION_CACHE_SIZE = int(os.environ.get("VALUATION_CACHE_SIZE", 256))
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+IMPORT_MAX_ROWS = int(os.environ.get("IMPORT_MAX_ROWS", 50000))
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", 4))
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 1024))
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1").lower() not in ("0", "false", "no")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+QUOTE_BATCH_SIZE = int(os.environ.get("QUOTE_BATCH_SIZE", 20))
+ASYNC_CONCURRENCY = int(os.environ.get("ASYNC_CONCURRENCY", 50))
+ASYNC_DEADLINE = float(os.environ.get("ASYNC_DEADLINE", 4))
+YAHOO_QUERY1_URL = os.environ.get("YAHOO_QUERY1_URL", "https://query1.finance.yahoo.com").rstrip('/')
+YAHOO_QUERY2_URL = os.environ.get("YAHOO_QUERY2_URL", "https://query2.finance.yahoo.com").rstrip('/')
+PUSHOVER_API_URL = os.environ.get("PUSHOVER_API_URL", "https://api.pushover.net/1/messages.json")
+NOTIFY_WORKERS = int(os.environ.get("NOTIFY_WORKERS", 4))
+NOTIFY_QUEUE_SIZE = int(os.environ.get("NOTIFY_QUEUE_SIZE", 10000))
+NOTIFY_MAX_RETRIES = int(os.environ.get("NOTIFY_MAX_RETRIES", 4))
+NOTIFY_BACKOFF = float(os.environ.get("NOTIFY_BACKOFF", 2.0))
+NOTIFY_GRACE_MINUTES = int(os.environ.get("NOTIFY_GRACE_MINUTES", 30))
+NOTIFY_STATE_FILE = os.path.join(DATA_DIR, "notify_state.json")
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED") == '1'
+SCHEDULER_POLL_SECONDS = int(os.environ.get("SCHEDULER_POLL_SECONDS", 10))
+SCHEDULE_CHANGES_FILE = os.path.join(DATA_DIR, "schedule_changes.jsonl")
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+HTTP_POOL_SIZES = dict(
+    (host.strip(), int(size)) for host, size in
+    (item.split('=', 1) for item in os.environ.get("HTTP_POOL_SIZES", "").split(',') if '=' in item)
+)
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.3))
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 30))
\ No newline at end of file
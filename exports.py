@@ -0,0 +1,125 @@
+import io
+import re
+import csv
+import json
+import zlib
+import zipfile
+import concurrent.futures
+from models import load_users, load_holdings, iter_history
+from config import EXPORT_WORKERS
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'jsonl.gz': ('application/gzip', 'jsonl.gz'),
+}
+FLUSH_BYTES = 64 * 1024
+
+
+def csv_lines(username):
+    buf = io.StringIO()
+    cw = csv.writer(buf)
+
+    def line(row):
+        buf.seek(0)
+        buf.truncate()
+        cw.writerow(row)
+        return buf.getvalue()
+
+    yield line(["--- CURRENT HOLDINGS ---"])
+    yield line(["Symbol", "Qty", "Avg Price"])
+    for x in load_holdings(username):
+        yield line([x['symbol'], x['qty'], x['priceBought']])
+    yield line([])
+    yield line(["--- TRANSACTION HISTORY ---"])
+    yield line(["Date", "Type", "Symbol", "Qty", "Price", "Realized Gain"])
+    for x in iter_history(username):
+        yield line([x['date'], x['type'], x['symbol'], x['qty'], x['price'], x.get('realized_gain', '-')])
+
+
+def jsonl_lines(username):
+    for x in load_holdings(username):
+        yield json.dumps({'kind': 'holding', **x}, separators=(',', ':')) + '\n'
+    for x in iter_history(username):
+        yield json.dumps({'kind': 'txn', **x}, separators=(',', ':')) + '\n'
+
+
+def _batched(lines):
+    # Group small lines into larger chunks so each yielded piece is worth a socket write.
+    chunk, size = [], 0
+    for line in lines:
+        data = line.encode()
+        chunk.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def gzip_stream(chunks, level=6):
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def export_stream(username, fmt):
+    lines = jsonl_lines(username) if fmt.startswith('jsonl') else csv_lines(username)
+    chunks = _batched(lines)
+    return gzip_stream(chunks) if fmt.endswith('.gz') else chunks
+
+
+class _ZipSink(io.RawIOBase):
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        out, self._parts = b''.join(self._parts), []
+        return out
+
+
+def _user_archive(username):
+    return username, b''.join(export_stream(username, 'jsonl.gz'))
+
+
+def bulk_export_stream(max_workers=EXPORT_WORKERS):
+    # Workers build and gzip one user each; the zip stores those members as-is and is streamed out as it grows.
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        usernames = list(load_users())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export') as executor:
+            pending, queue = set(), iter(usernames)
+            for name in queue:
+                pending.add(executor.submit(_user_archive, name))
+                if len(pending) >= max_workers * 2: break
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        name, data = future.result()
+                    except Exception as e:
+                        print(f"Export error: {e}")
+                        continue
+                    archive.writestr(f"{re.sub(r'[^a-zA-Z0-9]', '', name)}.jsonl.gz", data)
+                    yield sink.drain()
+                    nxt = next(queue, None)
+                    if nxt is not None:
+                        pending.add(executor.submit(_user_archive, nxt))
+    yield sink.drain()
@@ -0,0 +1,166 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+from metrics import upstream_latency, upstream_errors
+from config import (YAHOO_QUERY1_URL, YAHOO_QUERY2_URL, PUSHOVER_API_URL,
+                    HTTP_POOL_SIZE, HTTP_POOL_SIZES, HTTP_RETRIES, HTTP_BACKOFF, BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+DEFAULT_TIMEOUT = 5
+CONNECT_TIMEOUT = 2
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+def failed_status(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class _HostState:
+    __slots__ = ('failures', 'opened_at', 'trips')
+
+    def __init__(self):
+        self.failures = self.trips = 0
+        self.opened_at = None
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def allow(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state.opened_at is None: return True
+            now = time.monotonic()
+            if now - state.opened_at < self.cooldown: return False
+            # Half-open: one probe per cooldown; the rest keep failing fast until it succeeds.
+            state.opened_at = now
+            return True
+
+    def record(self, host, ok):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                if ok: return
+                state = self._hosts[host] = _HostState()
+            if ok:
+                state.failures, state.opened_at = 0, None
+                return
+            state.failures += 1
+            if state.opened_at is not None or state.failures >= self.threshold:
+                if state.opened_at is None: state.trips += 1
+                state.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {host: {'open': s.opened_at is not None, 'failures': s.failures, 'trips': s.trips}
+                    for host, s in self._hosts.items()}
+
+
+breaker = CircuitBreaker()
+
+
+class HttpClient:
+    def __init__(self, pool_size=HTTP_POOL_SIZE, host_pool_sizes=None, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF,
+                 known_urls=(YAHOO_QUERY1_URL, YAHOO_QUERY2_URL, PUSHOVER_API_URL)):
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._adapters = {}
+        self.requests = self.errors = 0
+        sizes = {_origin(url): pool_size for url in known_urls}
+        for host, size in (host_pool_sizes if host_pool_sizes is not None else HTTP_POOL_SIZES).items():
+            for scheme in ('https', 'http'):
+                sizes[f"{scheme}://{host}/"] = size
+        default = self._make_adapter(pool_size, retries, backoff)
+        self.session.mount('https://', default)
+        self.session.mount('http://', default)
+        self._adapters['*'] = default
+        for prefix, size in sizes.items():
+            adapter = self._make_adapter(size, retries, backoff)
+            self.session.mount(prefix, adapter)
+            self._adapters[prefix] = adapter
+
+    @staticmethod
+    def _make_adapter(size, retries, backoff):
+        # Only cheap failures are retried: refused or timed-out connects and 5xx answers. A read timeout already
+        # cost the full timeout, and a 429 only gets worse with retries, so both go straight to the caller and
+        # the circuit breaker. With the defaults a call gives up within about 7 seconds.
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=backoff,
+                      status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']),
+                      respect_retry_after_header=False, raise_on_status=False)
+        return HTTPAdapter(pool_connections=4, pool_maxsize=size, max_retries=retry, pool_block=False)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, DEFAULT_TIMEOUT))
+        host = urlsplit(url).netloc
+        if not breaker.allow(host):
+            upstream_errors.inc(host, 'circuit_open')
+            raise CircuitOpenError(f"Circuit open for {host}")
+        with self._lock:
+            self.requests += 1
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            with self._lock:
+                self.errors += 1
+            breaker.record(host, False)
+            kind = 'timeout' if isinstance(e, requests.Timeout) else 'connection'
+            upstream_latency.observe(time.perf_counter() - start, host, kind)
+            upstream_errors.inc(host, kind)
+            raise
+        breaker.record(host, not failed_status(resp.status_code))
+        upstream_latency.observe(time.perf_counter() - start, host, f"{resp.status_code // 100}xx")
+        if failed_status(resp.status_code):
+            upstream_errors.inc(host, 'status')
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        pools = {}
+        for prefix, adapter in self._adapters.items():
+            manager = adapter.poolmanager
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None: continue
+                name = f"{pool.scheme}://{pool.host}:{pool.port}"
+                entry = pools.setdefault(name, {'requests': 0, 'connections': 0, 'reused': 0, 'pool_size': 0})
+                entry['requests'] += pool.num_requests
+                entry['connections'] += pool.num_connections
+                entry['reused'] += max(0, pool.num_requests - pool.num_connections)
+                entry['pool_size'] = adapter._pool_maxsize
+        with self._lock:
+            return {'requests': self.requests, 'errors': self.errors, 'hosts': pools, 'breakers': breaker.stats()}
+
+
+client = HttpClient()
+
+
+def get(url, **kwargs):
+    return client.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return client.post(url, **kwargs)
+
+
+def stats():
+    return client.stats()
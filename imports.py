@@ -0,0 +1,153 @@
+import io
+import csv
+import json
+import gzip
+from datetime import datetime
+from models import load_holdings, save_portfolio, tail_history
+from utils import fetch_batch_prices
+from config import IMPORT_MAX_ROWS
+
+CSV_COLUMNS = ("Date", "Type", "Symbol", "Qty", "Price")
+DATE_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+
+def _text_stream(stream, filename):
+    raw = stream if hasattr(stream, 'peek') else io.BufferedReader(stream)
+    if filename.endswith('.gz') or raw.peek(2)[:2] == b'\x1f\x8b':
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+
+def _csv_records(text):
+    # Accepts the /export_data layout (holdings section first) or a bare transaction table.
+    columns = None
+    for line_no, row in enumerate(csv.reader(text), 1):
+        if not row or not any(cell.strip() for cell in row): continue
+        if columns is None:
+            header = [cell.strip() for cell in row]
+            if all(c in header for c in CSV_COLUMNS):
+                columns = {c: header.index(c) for c in CSV_COLUMNS}
+            continue
+        if row[0].startswith('---'): break
+        try:
+            yield line_no, {c.lower(): row[i] for c, i in columns.items()}
+        except IndexError:
+            yield line_no, "Missing columns"
+    if columns is None:
+        yield 0, "No transaction header found (expected Date,Type,Symbol,Qty,Price)"
+
+
+def _jsonl_records(text):
+    for line_no, line in enumerate(text, 1):
+        if not line.strip(): continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, "Expected a JSON object"
+        elif record.get('kind', 'txn') == 'txn':
+            yield line_no, record
+
+
+def _parse_date(value):
+    value = str(value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date '{value}'")
+
+
+def _clean(record):
+    when = _parse_date(record.get('date'))
+    txn_type = str(record.get('type') or '').strip().upper()
+    if txn_type not in ('BUY', 'SELL'): raise ValueError(f"Unknown type '{record.get('type')}'")
+    symbol = str(record.get('symbol') or '').strip().upper()
+    if not symbol: raise ValueError("Missing symbol")
+    try:
+        qty, price = float(record.get('qty')), float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid qty or price")
+    if qty <= 0 or price < 0: raise ValueError("Qty must be positive and price not negative")
+    return when, txn_type, symbol, qty, price
+
+
+def parse_upload(stream, filename=''):
+    name = filename.lower()
+    text = _text_stream(stream, name)
+    records = _jsonl_records(text) if '.jsonl' in name or '.ndjson' in name else _csv_records(text)
+    rows, errors = [], []
+    for line_no, record in records:
+        if isinstance(record, str):
+            errors.append({'line': line_no, 'error': record})
+            continue
+        try:
+            rows.append((line_no,) + _clean(record))
+        except ValueError as e:
+            errors.append({'line': line_no, 'error': str(e)})
+        if len(rows) + len(errors) > IMPORT_MAX_ROWS:
+            raise ValueError(f"Import is limited to {IMPORT_MAX_ROWS} rows")
+    return rows, errors
+
+
+def replay(holdings, rows):
+    # Same rules as /trade: buys average into priceBought, sells realize against it.
+    positions = {h['symbol']: dict(h) for h in holdings}
+    order = [h['symbol'] for h in holdings]
+    txns, errors = [], []
+    for line_no, when, txn_type, symbol, qty, price in sorted(rows, key=lambda r: r[1]):
+        pos = positions.get(symbol)
+        date_s = when.strftime("%Y-%m-%d %H:%M")
+        if txn_type == 'BUY':
+            if pos:
+                new_qty = pos['qty'] + qty
+                pos['priceBought'] = ((pos['qty'] * pos['priceBought']) + (qty * price)) / new_qty
+                pos['qty'] = new_qty
+            else:
+                positions[symbol] = {'symbol': symbol, 'qty': qty, 'priceBought': price}
+                order.append(symbol)
+            txns.append({'date': date_s, 'type': 'BUY', 'symbol': symbol, 'qty': qty, 'price': price,
+                         'realized_gain': None})
+        else:
+            if not pos or pos['qty'] < qty:
+                errors.append({'line': line_no, 'error': f"Insufficient quantity of {symbol}"})
+                continue
+            gain = (price - pos['priceBought']) * qty
+            pos['qty'] -= qty
+            if pos['qty'] <= 1e-6:
+                del positions[symbol]
+                order.remove(symbol)
+            txns.append({'date': date_s, 'type': 'SELL', 'symbol': symbol, 'qty': qty, 'price': price,
+                         'realized_gain': gain})
+    return [positions[s] for s in order], txns, errors
+
+
+def import_trades(username, stream, filename='', partial=False):
+    rows, errors = parse_upload(stream, filename)
+    # Rows are replayed on top of the current holdings and appended to the log, so they can only extend the
+    # history; an older trade would be applied against positions opened after it.
+    last = tail_history(username, 1)
+    if last:
+        latest = str(last[0].get('date', ''))[:16]
+        errors += [{'line': r[0], 'error': f"Dated before the latest existing transaction ({latest})"}
+                   for r in rows if r[1].strftime("%Y-%m-%d %H:%M") < latest]
+        rows = [r for r in rows if r[1].strftime("%Y-%m-%d %H:%M") >= latest]
+    holdings = load_holdings(username)
+    held = {h['symbol'] for h in holdings}
+    new_symbols = sorted({r[3] for r in rows} - held)
+    if new_symbols:
+        known = fetch_batch_prices(new_symbols)
+        unknown = {s for s in new_symbols if not known.get(s)}
+        if unknown:
+            errors += [{'line': r[0], 'error': f"Unknown symbol {r[3]}"} for r in rows if r[3] in unknown]
+            rows = [r for r in rows if r[3] not in unknown]
+    holdings, txns, replay_errors = replay(holdings, rows)
+    errors = sorted(errors + replay_errors, key=lambda e: e['line'])
+    committed = bool(txns) and (partial or not errors)
+    if committed:
+        save_portfolio(username, holdings, txns)
+    return {'committed': committed, 'imported': len(txns) if committed else 0, 'valid': len(txns),
+            'errors': errors}
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import threading
+import time
+from math import floor
+from limits.storage import Storage, SlidingWindowCounterSupport
+from limits.storage.base import TimestampedSlidingWindow
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_counters_expires ON counters (expires);
+"""
+
+# One statement, so concurrent workers never lose an increment; an expired row starts a fresh window.
+INCR = """
+INSERT INTO counters (key, count, expires) VALUES (?1, ?2, ?3)
+ON CONFLICT(key) DO UPDATE SET
+    count = CASE WHEN expires <= ?4 THEN excluded.count ELSE count + excluded.count END,
+    expires = CASE WHEN expires <= ?4 THEN excluded.expires ELSE expires END
+RETURNING count
+"""
+
+PURGE_SECONDS = 60
+
+
+class SqliteLimiterStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    # Registered with limits as the sqlite:// scheme: sqlite:///relative/path.db or sqlite:////absolute/path.db
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        path = (uri or '').partition('://')[2]
+        self.path = (path[1:] if path.startswith('/') else path) or ':memory:'
+        self._local = threading.local()
+        self._next_purge = 0
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            # Counters are disposable; losing the last few hits in a power cut is fine.
+            db.execute("PRAGMA synchronous=OFF")
+            self._local.db = db
+        return db
+
+    def _purge(self, db, now):
+        if now < self._next_purge: return
+        self._next_purge = now + PURGE_SECONDS
+        db.execute("DELETE FROM counters WHERE expires <= ?", (now,))
+
+    def _incr(self, db, key, expiry, amount, now):
+        self._purge(db, now)
+        return db.execute(INCR, (key, amount, now + expiry, now)).fetchone()[0]
+
+    def _get(self, db, key, now):
+        row = db.execute("SELECT count FROM counters WHERE key = ? AND expires > ?", (key, now)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key, expiry, amount=1):
+        return self._incr(self._connect(), key, expiry, amount, time.time())
+
+    def get(self, key):
+        return self._get(self._connect(), key, time.time())
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connect().execute("SELECT expires FROM counters WHERE key = ? AND expires > ?",
+                                      (key, now)).fetchone()
+        return row[0] if row else now
+
+    def clear(self, key):
+        self._connect().execute("DELETE FROM counters WHERE key = ?", (key,))
+
+    def reset(self):
+        return self._connect().execute("DELETE FROM counters").rowcount
+
+    def check(self):
+        try:
+            self._connect().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _window(self, db, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous = self._get(db, previous_key, now)
+        current = self._get(db, current_key, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous, previous_ttl, current, current_ttl, current_key
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit: return False
+        db = self._connect()
+        now = time.time()
+        # The write lock makes read-check-increment atomic across threads and worker processes.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            previous, previous_ttl, current, _, current_key = self._window(db, key, expiry, now)
+            allowed = floor(previous * previous_ttl / expiry + current) + amount <= limit
+            if allowed:
+                self._incr(db, current_key, 2 * expiry, amount, now)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return allowed
+
+    def get_sliding_window(self, key, expiry):
+        return self._window(self._connect(), key, expiry, time.time())[:4]
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self._connect().execute("DELETE FROM counters WHERE key IN (?, ?)", (previous_key, current_key))
@@ -0,0 +1,141 @@
+from collections import deque
+from datetime import date
+
+METHODS = ('fifo', 'lifo')
+LONG_TERM_DAYS = 365
+
+
+def _day(value):
+    return date.fromisoformat(str(value)[:10])
+
+
+class Lot:
+    __slots__ = ('lot_id', 'date', 'qty', 'price')
+
+    def __init__(self, lot_id, date, qty, price):
+        self.lot_id = lot_id
+        self.date = date
+        self.qty = qty
+        self.price = price
+
+    def to_row(self):
+        return [self.lot_id, self.date, self.qty, self.price]
+
+
+class LotBook:
+    # Open lots for one symbol in acquisition order. Specific-lot sells empty a lot in place;
+    # FIFO/LIFO skip those empty lots as they reach the ends, so every lot is popped at most once.
+    __slots__ = ('symbol', 'lots', 'by_id', 'qty')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.lots = deque()
+        self.by_id = {}
+        self.qty = 0.0
+
+    def buy(self, lot_id, when, qty, price):
+        lot = Lot(lot_id, when, qty, price)
+        self.lots.append(lot)
+        self.by_id[lot_id] = lot
+        self.qty += qty
+        return lot
+
+    def _consume(self, lot, qty, when, price, out):
+        take = min(lot.qty, qty)
+        lot.qty -= take
+        self.qty -= take
+        held = (_day(when) - _day(lot.date)).days
+        out.append({'symbol': self.symbol, 'lot_id': lot.lot_id, 'acquired': lot.date, 'sold': when, 'qty': take,
+                    'cost': take * lot.price, 'proceeds': take * price, 'gain': take * (price - lot.price),
+                    'holding_days': held, 'term': 'long' if held > LONG_TERM_DAYS else 'short'})
+        if lot.qty <= 1e-9:
+            del self.by_id[lot.lot_id]
+        return qty - take
+
+    def sell(self, when, qty, price, method='fifo', lot_id=None):
+        if qty > self.qty + 1e-9: raise ValueError(f"Insufficient quantity of {self.symbol}")
+        out = []
+        lot = self.by_id.get(lot_id) if lot_id is not None else None
+        # A named lot that can no longer cover the sell (e.g. after switching method) falls back to the method.
+        if lot is not None and lot.qty + 1e-9 >= qty:
+            self._consume(lot, qty, when, price, out)
+            return out
+        pop = self.lots.popleft if method == 'fifo' else self.lots.pop
+        while qty > 1e-9 and self.lots:
+            lot = self.lots[0] if method == 'fifo' else self.lots[-1]
+            if lot.qty > 1e-9:
+                qty = self._consume(lot, qty, when, price, out)
+            if lot.qty <= 1e-9:
+                pop()
+        return out
+
+    def open_lots(self):
+        return [lot for lot in self.lots if lot.qty > 1e-9]
+
+
+class LotLedger:
+    # `realized` only holds realizations made since the ledger was loaded or rebuilt.
+    __slots__ = ('method', 'books', 'realized', 'txn_count')
+
+    def __init__(self, method='fifo'):
+        if method not in METHODS: raise ValueError(f"Unknown lot method '{method}'")
+        self.method = method
+        self.books = {}
+        self.realized = []
+        self.txn_count = 0
+
+    def apply(self, txn):
+        # Lot ids are the transaction's position in the history, so a rebuild always yields the same ids.
+        lot_id = self.txn_count
+        self.txn_count += 1
+        sym = txn['symbol']
+        book = self.books.get(sym)
+        if txn['type'] == 'BUY':
+            if book is None:
+                book = self.books[sym] = LotBook(sym)
+            book.buy(lot_id, txn['date'], float(txn['qty']), float(txn['price']))
+        elif txn['type'] == 'SELL':
+            if book is None: raise ValueError(f"Insufficient quantity of {sym}")
+            realized = book.sell(txn['date'], float(txn['qty']), float(txn['price']), self.method, txn.get('lot_id'))
+            self.realized.extend(realized)
+            if book.qty <= 1e-9:
+                del self.books[sym]
+            return realized
+        return []
+
+    def apply_many(self, txns):
+        for txn in txns:
+            try:
+                self.apply(txn)
+            except ValueError as e:
+                print(f"Error applying lot {txn}: {e}")
+
+    def open_lots(self, today=None):
+        today = today or date.today()
+        out = {}
+        for sym, book in sorted(self.books.items()):
+            out[sym] = [{'lot_id': lot.lot_id, 'acquired': lot.date, 'qty': lot.qty, 'price': lot.price,
+                         'holding_days': (today - _day(lot.date)).days} for lot in book.open_lots()]
+        return out
+
+    def to_dict(self):
+        # Only open lots are snapshotted; realizations are append-only and stored separately,
+        # so saving after a trade costs O(open lots) rather than O(history).
+        return {'method': self.method, 'txn_count': self.txn_count,
+                'lots': {sym: [lot.to_row() for lot in book.open_lots()] for sym, book in self.books.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        ledger = cls(data.get('method', 'fifo'))
+        ledger.txn_count = data.get('txn_count', 0)
+        for sym, rows in data.get('lots', {}).items():
+            book = ledger.books[sym] = LotBook(sym)
+            for lot_id, when, qty, price in rows:
+                book.buy(lot_id, when, qty, price)
+        return ledger
+
+    @classmethod
+    def from_history(cls, history, method='fifo'):
+        ledger = cls(method)
+        ledger.apply_many(history)
+        return ledger
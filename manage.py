@@ -0,0 +1,94 @@
+import argparse
+from dotenv import load_dotenv
+load_dotenv()
+
+from config import SQLITE_PATH
+
+
+def migrate_sqlite(args):
+    from models import JsonStorage
+    from sqlite_storage import SqliteStorage
+    src, dst = JsonStorage(), SqliteStorage(args.db)
+    users = src.load_users()
+    dst.save_users(users)
+    txn_count = 0
+    for name in users:
+        holdings, history = src.load_holdings(name), src.load_history(name)
+        dst.replace_user_data(name, holdings, history)
+        txn_count += len(history)
+    print(f"Migrated {len(users)} users and {txn_count} transactions into {args.db}")
+
+
+def compact_history(args):
+    from models import load_users, compact_history
+    names = args.users or list(load_users())
+    damaged = sum(compact_history(name) for name in names)
+    print(f"Compacted history for {len(names)} users, dropped {damaged} damaged records")
+
+
+def rebuild_aggregates(args):
+    from models import load_users, rebuild_aggregates
+    names = args.users or list(load_users())
+    for name in names:
+        rebuild_aggregates(name)
+    print(f"Rebuilt portfolio aggregates for {len(names)} users")
+
+
+def rebuild_lots(args):
+    from models import load_users, rebuild_lots
+    names = args.users or list(load_users())
+    open_lots = sum(len(lots) for name in names for lots in rebuild_lots(name).open_lots().values())
+    print(f"Rebuilt tax lots for {len(names)} users, {open_lots} open lots")
+
+
+def update_prices(args):
+    from models import load_users, load_holdings
+    from price_store import price_store
+    symbols = args.symbols or sorted({h['symbol'] for name in load_users() for h in load_holdings(name)})
+    added = price_store.update_many([s.upper() for s in symbols])
+    print(f"Stored {sum(added.values())} new daily bars across {len(added)} symbols")
+
+
+def run_scheduler(args):
+    import threading
+    from scheduler import lead_and_run
+    stop = threading.Event()
+    try:
+        lead_and_run(stop)
+    except KeyboardInterrupt:
+        stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StockTracker maintenance commands")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('migrate-sqlite', help="Import the JSON files in data/ into the SQLite database")
+    p.add_argument('--db', default=SQLITE_PATH, help="SQLite database path (default: SQLITE_PATH)")
+    p.set_defaults(func=migrate_sqlite)
+
+    p = commands.add_parser('compact-history', help="Rewrite transaction logs, dropping torn or damaged records")
+    p.add_argument('users', nargs='*', help="Usernames to compact (default: all users)")
+    p.set_defaults(func=compact_history)
+
+    p = commands.add_parser('rebuild-aggregates', help="Recompute per-user realized P/L and win-rate aggregates from history")
+    p.add_argument('users', nargs='*', help="Usernames to rebuild (default: all users)")
+    p.set_defaults(func=rebuild_aggregates)
+
+    p = commands.add_parser('rebuild-lots', help="Rebuild per-user tax lots by replaying transaction history")
+    p.add_argument('users', nargs='*', help="Usernames to rebuild (default: all users)")
+    p.set_defaults(func=rebuild_lots)
+
+    p = commands.add_parser('update-prices', help="Append missing daily OHLC bars to the local price store")
+    p.add_argument('symbols', nargs='*', help="Symbols to update (default: every symbol held by any user)")
+    p.set_defaults(func=update_prices)
+
+    p = commands.add_parser('run-scheduler', help="Run the notification scheduler as a standalone sidecar process")
+    p.set_defaults(func=run_scheduler)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context, request, Response
+from config import SERVER_TIMING
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names: return ''
+    pairs = ','.join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for labels, counts, total, count in sorted(items):
+            running = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                running += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (le,))} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in items]
+        return lines
+
+
+request_latency = Histogram('stocktracker_request_seconds', "Request latency by route", ('route', 'method', 'status'))
+upstream_latency = Histogram('stocktracker_upstream_seconds', "Outbound HTTP latency by host", ('host', 'outcome'))
+upstream_errors = Counter('stocktracker_upstream_errors_total', "Outbound HTTP failures by host and kind",
+                          ('host', 'kind'))
+span_latency = Histogram('stocktracker_span_seconds', "Time spent in instrumented request stages", ('span',))
+REGISTRY = [request_latency, span_latency, upstream_latency, upstream_errors]
+
+
+def record_span(name, seconds):
+    span_latency.observe(seconds, name)
+    if has_request_context():
+        spans = g.setdefault('spans', {})
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def timed(name):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def family_lines(name, kind, help, samples):
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+
+def runtime_families():
+    # Point-in-time values are read from the components' own stats() at scrape time, so nothing is paid per request.
+    import http_client
+    from notifications import dispatcher
+    from rendering import fragments
+    from streaming import price_poller
+    from utils import quote_cache, news_cache
+    caches = {'quotes': quote_cache.stats(), 'news': news_cache.stats(), 'fragments': fragments.stats()}
+    news, pushover, http = caches['news'], dispatcher.stats(), http_client.stats()
+    hosts = http['hosts'].items()
+    return [
+        ('stocktracker_cache_hits_total', 'counter', "Cache hits",
+         [({'cache': k}, v['hits']) for k, v in caches.items()]),
+        ('stocktracker_cache_misses_total', 'counter', "Cache misses",
+         [({'cache': k}, v['misses']) for k, v in caches.items()]),
+        ('stocktracker_cache_hit_ratio', 'gauge', "Cache hit ratio since start",
+         [({'cache': k}, round(v['hit_ratio'], 4)) for k, v in caches.items()]),
+        ('stocktracker_cache_entries', 'gauge', "Entries held per cache",
+         [({'cache': k}, v['size']) for k, v in caches.items()]),
+        ('stocktracker_queue_depth', 'gauge', "Jobs waiting for a worker thread",
+         [({'pool': 'pushover'}, pushover['queue_depth']), ({'pool': 'news'}, news['queued'])]),
+        ('stocktracker_pool_workers', 'gauge', "Live worker threads",
+         [({'pool': 'pushover'}, pushover['workers']), ({'pool': 'news'}, news['workers'])]),
+        ('stocktracker_http_connections', 'gauge', "Connections opened per upstream pool",
+         [({'host': h}, v['connections']) for h, v in hosts]),
+        ('stocktracker_http_reused_total', 'counter', "Requests served on a reused connection",
+         [({'host': h}, v['reused']) for h, v in hosts]),
+        ('stocktracker_circuit_open', 'gauge', "1 while requests to the host fail fast",
+         [({'host': h}, int(v['open'])) for h, v in http['breakers'].items()]),
+        ('stocktracker_circuit_trips_total', 'counter', "Times the host's circuit breaker opened",
+         [({'host': h}, v['trips']) for h, v in http['breakers'].items()]),
+        ('stocktracker_quotes_stale_served_total', 'counter', "Last-known quotes served after a failed refresh",
+         [({}, caches['quotes']['stale_served'])]),
+        ('stocktracker_quotes_not_found', 'gauge', "Symbols cached as having no quote",
+         [({}, caches['quotes']['not_found'])]),
+        ('stocktracker_stream_subscribers', 'gauge', "Open price streams",
+         [({}, price_poller.stats()['subscribers'])]),
+    ]
+
+
+def expose(families=()):
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.expose()
+    for family in families:
+        lines += family_lines(*family)
+    return '\n'.join(lines) + '\n'
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.pop('request_start', None)
+    if start is None: return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_latency.observe(elapsed, route, request.method, f"{response.status_code // 100}xx")
+    if SERVER_TIMING:
+        spans = g.get('spans') or {}
+        timing = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items()]
+        timing.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers['Server-Timing'] = ', '.join(timing)
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('render_stack', []).append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    stack = g.get('render_stack') if has_request_context() else None
+    if stack:
+        start = stack.pop()
+        # Nested renders (fragments) are already inside the outer render's time.
+        if not stack: record_span('render', time.perf_counter() - start)
+
+
+def init_metrics(app):
+    from flask import before_render_template, template_rendered
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+
+
+def metrics_response():
+    return Response(expose(runtime_families()), mimetype='text/plain; version=0.0.4')
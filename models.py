@@ -1,12 +1,19 @@
 import os
 import json
 import re
-from config import DATA_DIR, USERS_FILE
+import threading
+import txn_log
+from contextlib import contextmanager, suppress
+from locks import FileLock, atomic_write
+from metrics import timed
+from portfolio import apply_txn_stats, realized_stats
+from lots import LotLedger
+from config import DATA_DIR, USERS_FILE, STORAGE_BACKEND, SQLITE_PATH, SCHEDULE_CHANGES_FILE
 
-def get_safe_filename(username, file_type):
+def get_safe_filename(username, file_type, ext='json'):
     if not username: return None
     clean_name = re.sub(r'[^a-zA-Z0-9]', '', username)
-    return os.path.join(DATA_DIR, f"{file_type}_{clean_name}.json")
+    return os.path.join(DATA_DIR, f"{file_type}_{clean_name}.{ext}")
 
 def load_json(filepath):
     if not filepath or not os.path.exists(filepath): return []
@@ -16,14 +23,335 @@ def load_json(filepath):
 
 def save_json(filepath, data):
     try:
-        with open(filepath, 'w') as f: json.dump(data, f, indent=4)
+        atomic_write(filepath, json.dumps(data, indent=4))
     except: pass
 
+
+def txn_matcher(symbol=None, txn_type=None, start=None, end=None):
+    if not (symbol or txn_type or start or end): return None
+
+    def match(r):
+        if symbol and r.get('symbol') != symbol: return False
+        if txn_type and r.get('type') != txn_type: return False
+        day = str(r.get('date', ''))[:10]
+        if start and day < start: return False
+        if end and day > end: return False
+        return True
+
+    return match
+
+
+class JsonStorage:
+    name = 'json'
+
+    def __init__(self, users_file=USERS_FILE):
+        self.users_file = users_file
+        self._users_lock = FileLock(f"{users_file}.lock")
+        self._cache_lock = threading.Lock()
+        self._users = {}
+        self._users_sig = None
+        self._history_locks = {}
+        self.user_reloads = 0
+
+    def _user_index(self):
+        try:
+            st = os.stat(self.users_file)
+            sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            sig = None
+        with self._cache_lock:
+            if sig != self._users_sig:
+                users = {}
+                if sig:
+                    try:
+                        with open(self.users_file, 'r') as f: users = json.load(f)
+                    except: users = {}
+                self._users, self._users_sig = users, sig
+                self.user_reloads += 1
+            return self._users
+
+    def load_users(self):
+        return {name: dict(u) for name, u in self._user_index().items()}
+
+    def get_user(self, username):
+        u = self._user_index().get(username)
+        return dict(u) if u is not None else None
+
+    def save_users(self, users):
+        with self._users_lock:
+            self._write_users(users)
+
+    def _write_users(self, users):
+        atomic_write(self.users_file, json.dumps(users, indent=4))
+
+    @contextmanager
+    def edit_users(self):
+        with self._users_lock:
+            users = self.load_users()
+            yield users
+            self._write_users(users)
+
+    def load_holdings(self, username):
+        return load_json(get_safe_filename(username, 'holdings'))
+
+    def save_holdings(self, username, holdings):
+        save_json(get_safe_filename(username, 'holdings'), holdings)
+
+    def _history_lock(self, log_f):
+        # Appends, repairs and the legacy conversion all replace or extend the same log, so they take turns.
+        with self._cache_lock:
+            lock = self._history_locks.get(log_f)
+            if lock is None:
+                lock = self._history_locks[log_f] = FileLock(f"{log_f}.lock")
+            return lock
+
+    def _history_log(self, username):
+        log_f = get_safe_filename(username, 'history', 'jsonl')
+        legacy_f = get_safe_filename(username, 'history')
+        if os.path.exists(legacy_f):
+            with self._history_lock(log_f):
+                # Another request may have converted it while this one waited for the lock.
+                if os.path.exists(legacy_f):
+                    txn_log.rewrite(log_f, load_json(legacy_f) + list(txn_log.iter_records(log_f)))
+                    with suppress(FileNotFoundError): os.remove(legacy_f)
+        return log_f
+
+    def _repair_history(self, log_f):
+        # Re-reads under the lock so records appended since the caller's read survive the rewrite.
+        with self._history_lock(log_f):
+            history, damaged = txn_log.read(log_f)
+            if damaged:
+                txn_log.rewrite(log_f, history)
+        return history, damaged
+
+    def load_history(self, username):
+        log_f = self._history_log(username)
+        history, damaged = txn_log.read(log_f)
+        if damaged:
+            history, _ = self._repair_history(log_f)
+        return history
+
+    def iter_history(self, username, reverse=False):
+        log_f = self._history_log(username)
+        return txn_log.iter_reverse(log_f) if reverse else txn_log.iter_records(log_f)
+
+    def tail_history(self, username, n):
+        return txn_log.tail(self._history_log(username), n)
+
+    def history_page(self, username, cursor=None, limit=50, symbol=None, txn_type=None, start=None, end=None):
+        log_f = self._history_log(username)
+        try:
+            ino = os.stat(log_f).st_ino
+        except OSError:
+            return [], None
+        end_offset = None
+        if cursor:
+            # Offsets survive appends but not a rewrite, which gives the log a new inode.
+            c_ino, _, c_off = cursor.partition('.')
+            if int(c_ino, 16) != ino: raise ValueError("History changed, reload the first page")
+            end_offset = int(c_off, 16)
+        match = txn_matcher(symbol, txn_type, start, end)
+        rows, offset = txn_log.page(log_f, end_offset, limit, match, symbol.encode() if symbol else None)
+        return rows, (f"{ino:x}.{offset:x}" if offset is not None else None)
+
+    def history_version(self, username):
+        try:
+            st = os.stat(self._history_log(username))
+        except OSError:
+            return '0'
+        return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    def save_history(self, username, history):
+        log_f = get_safe_filename(username, 'history', 'jsonl')
+        with self._history_lock(log_f):
+            txn_log.rewrite(log_f, history)
+            with suppress(FileNotFoundError): os.remove(get_safe_filename(username, 'history'))
+            self.save_aggregates(username, realized_stats(history))
+
+    def append_history(self, username, txns):
+        log_f = self._history_log(username)
+        with self._history_lock(log_f):
+            txn_log.append(log_f, txns)
+
+    def compact_history(self, username):
+        return self._repair_history(self._history_log(username))[1]
+
+    def load_aggregates(self, username):
+        path = get_safe_filename(username, 'aggregates')
+        if not os.path.exists(path): return None
+        agg = load_json(path)
+        return agg if isinstance(agg, dict) and agg else None
+
+    def save_aggregates(self, username, aggregates):
+        atomic_write(get_safe_filename(username, 'aggregates'), json.dumps(aggregates))
+
+    def rebuild_aggregates(self, username):
+        log_f = self._history_log(username)
+        with self._history_lock(log_f):
+            agg = realized_stats(txn_log.iter_records(log_f))
+            self.save_aggregates(username, agg)
+        return agg
+
+    def load_lots(self, username):
+        path = get_safe_filename(username, 'lots')
+        if not os.path.exists(path): return None
+        data = load_json(path)
+        return data if isinstance(data, dict) and data else None
+
+    def save_lots(self, username, data, realized, replace=False):
+        gains_f = get_safe_filename(username, 'lot_gains', 'jsonl')
+        if replace:
+            txn_log.rewrite(gains_f, realized)
+        else:
+            txn_log.append(gains_f, realized)
+        atomic_write(get_safe_filename(username, 'lots'), json.dumps(data, separators=(',', ':')))
+
+    def load_realized_lots(self, username):
+        return list(txn_log.iter_records(get_safe_filename(username, 'lot_gains', 'jsonl')))
+
+    def save_portfolio(self, username, holdings, txns):
+        self.save_holdings(username, holdings)
+        if not txns: return
+        log_f = self._history_log(username)
+        # The totals are read-modify-write, so the append and the update share the log's lock; otherwise
+        # concurrent trades overwrite each other's increments.
+        with self._history_lock(log_f):
+            agg = self.load_aggregates(username)
+            txn_log.append(log_f, txns)
+            if agg is None:
+                agg = realized_stats(txn_log.iter_records(log_f))
+            else:
+                for txn in txns:
+                    apply_txn_stats(agg, txn)
+            self.save_aggregates(username, agg)
+
+    def delete_user_data(self, username):
+        for path in (get_safe_filename(username, 'holdings'), get_safe_filename(username, 'history'),
+                     get_safe_filename(username, 'history', 'jsonl'), get_safe_filename(username, 'aggregates'),
+                     get_safe_filename(username, 'lots'), get_safe_filename(username, 'lot_gains', 'jsonl')):
+            if path and os.path.exists(path): os.remove(path)
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == 'sqlite':
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(SQLITE_PATH)
+    if backend != 'json':
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'")
+    return JsonStorage()
+
+
+storage = create_storage()
+
 def load_users():
-    if not os.path.exists(USERS_FILE): return {}
-    try:
-        with open(USERS_FILE, 'r') as f: return json.load(f)
-    except: return {}
+    return storage.load_users()
 
 def save_users(users):
-    with open(USERS_FILE, 'w') as f: json.dump(users, f, indent=4)
\ No newline at end of file
+    before = _notify_freqs(storage.load_users())
+    storage.save_users(users)
+    record_schedule_changes(before, _notify_freqs(users))
+
+def get_user(username):
+    return storage.get_user(username)
+
+@contextmanager
+def edit_users():
+    with storage.edit_users() as users:
+        before = _notify_freqs(users)
+        yield users
+    record_schedule_changes(before, _notify_freqs(users))
+
+def _notify_freqs(users):
+    return {name: u.get('notify_freq') or 'none' for name, u in users.items()}
+
+def record_schedule_changes(before, after, path=SCHEDULE_CHANGES_FILE):
+    # The scheduler may run in another process, so frequency changes go to an append-only journal that it tails
+    # instead of rereading every user.
+    changes = [{'user': name, 'freq': after.get(name, 'none')}
+               for name in set(before) | set(after) if before.get(name, 'none') != after.get(name, 'none')]
+    if not changes: return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, ''.join(json.dumps(c) + '\n' for c in changes).encode())
+    finally:
+        os.close(fd)
+
+@timed('storage')
+def load_holdings(username):
+    return storage.load_holdings(username)
+
+def save_holdings(username, holdings):
+    storage.save_holdings(username, holdings)
+
+@timed('storage')
+def load_history(username):
+    return storage.load_history(username)
+
+def save_history(username, history):
+    storage.save_history(username, history)
+    rebuild_lots(username)
+
+def iter_history(username, reverse=False):
+    return storage.iter_history(username, reverse)
+
+def tail_history(username, n):
+    return storage.tail_history(username, n)
+
+@timed('storage')
+def history_page(username, cursor=None, limit=50, symbol=None, txn_type=None, start=None, end=None):
+    return storage.history_page(username, cursor, limit, symbol, txn_type, start, end)
+
+def history_version(username):
+    return storage.history_version(username)
+
+def compact_history(username):
+    return storage.compact_history(username)
+
+@timed('storage')
+def load_stats(username):
+    agg = storage.load_aggregates(username)
+    if agg is None:
+        agg = storage.rebuild_aggregates(username)
+    return agg
+
+def rebuild_aggregates(username):
+    return storage.rebuild_aggregates(username)
+
+@timed('storage')
+def save_portfolio(username, holdings, txns=()):
+    txns = list(txns)
+    storage.save_portfolio(username, holdings, txns)
+    if txns: update_lots(username, txns)
+
+def lot_method(username):
+    return (get_user(username) or {}).get('lot_method', 'fifo')
+
+def rebuild_lots(username, method=None):
+    ledger = LotLedger.from_history(storage.iter_history(username), method or lot_method(username))
+    storage.save_lots(username, ledger.to_dict(), ledger.realized, replace=True)
+    return ledger
+
+@timed('storage')
+def load_lots(username):
+    data = storage.load_lots(username)
+    if data is None or data.get('method') != lot_method(username):
+        return rebuild_lots(username)
+    return LotLedger.from_dict(data)
+
+def update_lots(username, txns):
+    # Only the new trades are applied; a missing or out-of-step ledger is rebuilt from history instead.
+    data = storage.load_lots(username)
+    ledger = LotLedger.from_dict(data) if data else None
+    if ledger is None or ledger.method != lot_method(username) or \
+            ledger.txn_count + len(txns) != (storage.load_aggregates(username) or {}).get('txn_count'):
+        return rebuild_lots(username)
+    ledger.apply_many(txns)
+    storage.save_lots(username, ledger.to_dict(), ledger.realized)
+    return ledger
+
+def load_realized_lots(username):
+    return storage.load_realized_lots(username)
+
+def delete_user_data(username):
+    storage.delete_user_data(username)
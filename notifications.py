@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import queue
+import threading
+from datetime import datetime, timedelta, time as dtime
+from config import (MARKET_OPEN, MARKET_CLOSE, US_EASTERN, PUSHOVER_API_URL,
+                    NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE, NOTIFY_MAX_RETRIES, NOTIFY_BACKOFF,
+                    NOTIFY_GRACE_MINUTES, NOTIFY_STATE_FILE)
+from locks import FileLock, atomic_write
+from models import load_holdings
+from utils import fetch_batch_prices, post_pushover, pushover_accepted
+
+PUSHOVER_MAX_RECIPIENTS = 50
+
+
+class _Job:
+    __slots__ = ('user_keys', 'callbacks', 'message', 'attempt', 'solo')
+
+    def __init__(self, user_keys, message, attempt=0, solo=False, callbacks=None):
+        self.user_keys = user_keys
+        # One optional on_done(delivered) per recipient, called once the message is sent or given up on.
+        self.callbacks = callbacks or [None] * len(user_keys)
+        self.message = message
+        self.attempt = attempt
+        self.solo = solo
+
+
+class PushoverDispatcher:
+    def __init__(self, url=PUSHOVER_API_URL, workers=NOTIFY_WORKERS, queue_size=NOTIFY_QUEUE_SIZE,
+                 max_retries=NOTIFY_MAX_RETRIES, backoff=NOTIFY_BACKOFF, post=post_pushover):
+        self.url = url
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.post = post
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pending = {}
+        self._retries_pending = 0
+        self._paused_until = 0
+        self.app_remaining = None
+        self.counts = {'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0, 'rate_limited': 0,
+                       'requests': 0}
+
+    def enqueue(self, user_key, message, on_done=None):
+        if not user_key:
+            return False
+        self._ensure_workers()
+        with self._lock:
+            # Pushover accepts up to 50 comma-separated user keys for the same message, so recipients join a
+            # job for that message that no worker has picked up yet.
+            job = self._pending.get(message)
+            if job is not None and len(job.user_keys) < PUSHOVER_MAX_RECIPIENTS:
+                job.user_keys.append(user_key)
+                job.callbacks.append(on_done)
+            else:
+                job = _Job([user_key], message, callbacks=[on_done])
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    self.counts['dropped'] += 1
+                    return False
+                self._pending[message] = job
+            self.counts['queued'] += 1
+        return True
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._work, name=f'pushover-{len(self._threads)}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counts[key] += n
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if self._pending.get(job.message) is job:
+                    del self._pending[job.message]
+            try:
+                self._deliver(job)
+            except Exception as e:
+                print(f"Pushover dispatch error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, job, delivered):
+        for callback in job.callbacks:
+            if callback is None: continue
+            try:
+                callback(delivered)
+            except Exception as e:
+                print(f"Pushover callback error: {e}")
+
+    def _deliver(self, job):
+        wait = self._paused_until - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        self._count('requests')
+        try:
+            response = self.post(','.join(job.user_keys), job.message, self.url)
+        except Exception as e:
+            print(f"Pushover error: {e}")
+            self._retry(job)
+            return
+        self._track_limits(response)
+        if pushover_accepted(response):
+            self._count('sent', len(job.user_keys))
+            self._finish(job, True)
+        elif response.status_code == 429:
+            self._count('rate_limited')
+            self._retry(job)
+        elif response.status_code >= 500:
+            self._retry(job)
+        elif len(job.user_keys) > 1:
+            # One bad user key rejects the whole batch, so resend each recipient on its own.
+            for user_key, callback in zip(job.user_keys, job.callbacks):
+                self._requeue(_Job([user_key], job.message, job.attempt, solo=True, callbacks=[callback]), retry=False)
+        else:
+            print(f"Pushover rejected message ({response.status_code}): {response.text[:200]}")
+            self._count('failed', len(job.user_keys))
+            self._finish(job, False)
+
+    def _track_limits(self, response):
+        remaining = response.headers.get('X-Limit-App-Remaining')
+        reset = response.headers.get('X-Limit-App-Reset')
+        try:
+            if remaining is not None:
+                self.app_remaining = int(remaining)
+            if reset is not None and (response.status_code == 429 or self.app_remaining == 0):
+                self._paused_until = max(self._paused_until, float(reset))
+        except ValueError:
+            pass
+
+    def _retry(self, job):
+        if job.attempt >= self.max_retries:
+            self._count('failed', len(job.user_keys))
+            self._finish(job, False)
+            return
+        job.attempt += 1
+        self._count('retried')
+        delay = max(self.backoff * (2 ** (job.attempt - 1)), self._paused_until - time.time())
+        with self._lock:
+            self._retries_pending += 1
+        timer = threading.Timer(delay, self._requeue, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, job, retry=True):
+        if retry:
+            with self._lock:
+                self._retries_pending -= 1
+        try:
+            self._queue.put(job, timeout=5)
+        except queue.Full:
+            self._count('dropped', len(job.user_keys))
+            self._finish(job, False)
+
+    def join(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks or self._retries_pending:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.counts)
+            result.update({
+                'queue_depth': self._queue.qsize(),
+                'retries_pending': self._retries_pending,
+                'workers': len([t for t in self._threads if t.is_alive()]),
+                'app_remaining': self.app_remaining,
+                'paused_until': self._paused_until if self._paused_until > time.time() else None
+            })
+            return result
+
+
+dispatcher = PushoverDispatcher()
+
+
+def slot_times(freq):
+    if freq == 'open':
+        return [dtime(9, 30)]
+    if freq == 'open_close':
+        return [dtime(9, 30), dtime(15, 30)]
+    hours = [dtime(h) for h in range(24) if MARKET_OPEN <= dtime(h) <= MARKET_CLOSE]
+    if freq == 'hourly':
+        return hours
+    if freq == '2hours':
+        return [t for t in hours if t.hour % 2 != 0]
+    return []
+
+
+def slots_on(freq, day):
+    if day.weekday() >= 5: return []
+    return [US_EASTERN.localize(datetime.combine(day, t)) for t in slot_times(freq)]
+
+
+def due_slot(freq, now_et, grace_minutes=NOTIFY_GRACE_MINUTES):
+    for slot in reversed(slots_on(freq, now_et.date())):
+        if slot <= now_et:
+            return slot if now_et - slot < timedelta(minutes=grace_minutes) else None
+    return None
+
+
+def next_slot(freq, after_et):
+    if not slot_times(freq): return None
+    day = after_et.date()
+    for _ in range(8):
+        for slot in slots_on(freq, day):
+            if slot > after_et:
+                return slot
+        day += timedelta(days=1)
+    return None
+
+
+class NotifyState:
+    def __init__(self, path=NOTIFY_STATE_FILE):
+        self.path = path
+        self.lock = FileLock(f"{path}.lock")
+
+    def load(self):
+        if not os.path.exists(self.path): return {}
+        try:
+            with open(self.path, 'r') as f: return json.load(f)
+        except: return {}
+
+    def mark(self, markers):
+        if not markers: return
+        state = self.load()
+        state.update(markers)
+        atomic_write(self.path, json.dumps(state))
+
+    def restore(self, claims, previous):
+        # Caller holds the lock. Puts back the earlier marker for slots that were claimed but not delivered,
+        # unless a later run has claimed them since, so the next run within the grace window sends them again.
+        state = self.load()
+        for name, stamp in claims.items():
+            if state.get(name) != stamp: continue
+            if previous.get(name) is None:
+                state.pop(name, None)
+            else:
+                state[name] = previous[name]
+        atomic_write(self.path, json.dumps(state))
+
+    def on_done(self, name, stamp, previous):
+        def done(delivered):
+            if delivered: return
+            with self.lock:
+                self.restore({name: stamp}, {name: previous})
+        return done
+
+
+notify_state = NotifyState()
+
+
+def build_summary(holdings, price_map):
+    tv, tu = 0, 0
+    daily_moves = {}
+    for h in holdings:
+        data = price_map.get(h['symbol'])
+        if data:
+            c = data['price']
+            prev = data['prev']
+            tv += c * h['qty']
+            tu += (c - h['priceBought']) * h['qty']
+            if prev:
+                daily_moves[h['symbol']] = ((c - prev) / prev) * 100
+
+    top = max(daily_moves, key=lambda k: abs(daily_moves[k])) if daily_moves else None
+    mover = f"{top} {daily_moves[top]:.2f}%" if top else "N/A"
+    return f"Update: Val ${tv:,.0f} | P/L ${tu:,.0f} | Top: {mover}"
+
+
+def run_notifications(users, now_et=None, send=None, state=None, fetch=None):
+    state = state or notify_state
+    with state.lock:
+        return _run_notifications(users, now_et or datetime.now(US_EASTERN), send or dispatcher.enqueue, state,
+                                  fetch or fetch_batch_prices)
+
+
+def _run_notifications(users, now_et, send, state, fetch):
+    timings = {}
+    stage_start = time.perf_counter()
+
+    def mark(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[stage] = round((now - stage_start) * 1000, 2)
+        stage_start = now
+
+    last_sent = state.load()
+    due = []
+    for name, u in users.items():
+        slot = due_slot(u.get('notify_freq', 'none'), now_et)
+        if slot and last_sent.get(name, 0) < slot.timestamp():
+            due.append((name, u, slot))
+    mark('select')
+
+    portfolios = []
+    for name, u, slot in due:
+        holdings = load_holdings(name)
+        if holdings:
+            portfolios.append((name, u, holdings, slot))
+    mark('load')
+
+    symbols = list(dict.fromkeys(h['symbol'] for _, _, holdings, _ in portfolios for h in holdings))
+    price_map = fetch(symbols)
+    mark('fetch')
+
+    messages = [(name, u.get('po_user'), build_summary(holdings, price_map), slot)
+                for name, u, holdings, slot in portfolios]
+    mark('compute')
+
+    # Slots are claimed in the state file before anything is queued, so a second run in another worker skips these
+    # users. A message the dispatcher gives up on releases its claim again.
+    claims = {name: slot.timestamp() for name, _, _, slot in messages}
+    previous = {name: last_sent.get(name) for name in claims}
+    state.mark(claims)
+    sent = failed = 0
+    refused = {}
+    for name, user_key, message, slot in messages:
+        if send(user_key, message, state.on_done(name, claims[name], previous[name])):
+            sent += 1
+        else:
+            refused[name] = claims[name]
+            failed += 1
+    if refused:
+        state.restore(refused, previous)
+    mark('dispatch')
+
+    timings['total'] = round(sum(timings.values()), 2)
+    return {
+        'processed': sent,
+        'failed': failed,
+        'due_users': len(due),
+        'notified_users': len(messages),
+        'symbols': len(symbols),
+        'quotes': len(price_map),
+        'timings_ms': timings
+    }
@@ -0,0 +1,101 @@
+def empty_stats():
+    return {'txn_count': 0, 'total_sells': 0, 'wins': 0, 'win_rate': 0, 'realized': 0, 'realized_cost_basis': 0}
+
+
+def apply_txn_stats(stats, txn):
+    stats['txn_count'] += 1
+    if txn.get('realized_gain') is not None:
+        stats['realized'] += txn['realized_gain'] or 0
+    if txn.get('type') == 'SELL':
+        stats['total_sells'] += 1
+        if (txn.get('realized_gain') or 0) > 0:
+            stats['wins'] += 1
+        stats['realized_cost_basis'] += txn.get('price', 0) * txn.get('qty', 0)
+    stats['win_rate'] = (stats['wins'] / stats['total_sells'] * 100) if stats['total_sells'] > 0 else 0
+    return stats
+
+
+def realized_stats(history):
+    stats = empty_stats()
+    for txn in history:
+        apply_txn_stats(stats, txn)
+    return stats
+
+
+def value_portfolio(holdings, stats, price_map, not_found=()):
+    tv, tc, tu = 0, 0, 0
+    stale = unpriced = 0
+    daily_dollar_change = 0
+    previous_portfolio_val = 0
+
+    proc = []
+    chart_labels = []
+    chart_data = []
+
+    for h in holdings:
+        s = dict(h)
+        data = price_map.get(s['symbol'])
+
+        if data:
+            curr = data['price']
+            prev = data['prev']
+            s['current_price'] = curr
+            s['prev_close'] = prev
+            s['price_status'] = 'stale' if data.get('stale') else 'live'
+            if data.get('stale'):
+                s['price_as_of'] = data.get('as_of')
+                stale += 1
+
+            val = curr * s['qty']
+            cost_basis = s['priceBought'] * s['qty']
+            unr = val - cost_basis
+
+            if prev:
+                day_gain = (curr - prev) * s['qty']
+                daily_dollar_change += day_gain
+                previous_portfolio_val += (prev * s['qty'])
+
+            s['total_value'] = val
+            s['unrealised'] = unr
+            s['pct_change'] = ((curr - s['priceBought']) / s['priceBought']) * 100 if s['priceBought'] else 0
+
+            tv += val
+            tc += cost_basis
+            tu += unr
+
+            chart_labels.append(s['symbol'])
+            chart_data.append(round(val, 2))
+        else:
+            s['current_price'] = s['prev_close'] = None
+            s['total_value'] = s['unrealised'] = s['pct_change'] = None
+            # not_found: Yahoo has no such symbol; unavailable: the lookup failed and no earlier price is cached.
+            s['price_status'] = 'not_found' if s['symbol'] in not_found else 'unavailable'
+            unpriced += 1
+
+        proc.append(s)
+
+    total_growth = stats['realized'] + tu
+    lifetime_cost_basis = tc + stats['realized_cost_basis']
+    total_growth_pct = (total_growth / lifetime_cost_basis * 100) if lifetime_cost_basis > 0 else 0
+    daily_pct = (daily_dollar_change / previous_portfolio_val * 100) if previous_portfolio_val > 0 else 0
+
+    totals = {
+        'value': tv,
+        'unrealised': tu,
+        'pct': ((tv - tc) / tc * 100) if tc > 0 else 0,
+        'realized': stats['realized'],
+        'growth': total_growth,
+        'growth_pct': total_growth_pct,
+        'daily_val': daily_dollar_change,
+        'daily_pct': daily_pct,
+        'win_rate': stats['win_rate'],
+        'total_trades': stats['total_sells'],
+        'stale_prices': stale,
+        'missing_prices': unpriced
+    }
+
+    return {
+        'holdings': sorted(proc, key=lambda x: (x.get('total_value') or 0), reverse=True),
+        'totals': totals,
+        'chart': {'labels': chart_labels, 'data': chart_data}
+    }
@@ -0,0 +1,163 @@
+import os
+import re
+import threading
+import concurrent.futures
+from datetime import datetime, date, timedelta
+import numpy as np
+import http_client
+from config import DATA_DIR, US_EASTERN, MARKET_CLOSE, YAHOO_QUERY1_URL, PRICE_HISTORY_YEARS
+from locks import FileLock
+
+PRICES_DIR = os.path.join(DATA_DIR, "prices")
+EPOCH = date(1970, 1, 1)
+
+COLUMNS = {
+    'date': np.int32,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.int64,
+}
+
+
+def to_day(d):
+    return (d - EPOCH).days
+
+
+def from_day(n):
+    return EPOCH + timedelta(days=int(n))
+
+
+class PriceStore:
+    def __init__(self, root=PRICES_DIR, base_url=YAHOO_QUERY1_URL):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, symbol):
+        name = re.sub(r'[^A-Z0-9.\-^=]', '_', symbol.upper())
+        # A leading dot would let "." or ".." resolve to the store root or its parent.
+        if not name or name.startswith('.'): name = f"_{name}"
+        return os.path.join(self.root, name)
+
+    def _path(self, symbol, column):
+        return os.path.join(self._dir(symbol), f"{column}.bin")
+
+    def _attempt_path(self, symbol):
+        return os.path.join(self._dir(symbol), ".attempted")
+
+    def last_attempt(self, symbol):
+        # Wall-clock time of the last download attempt, shared by every worker through the file's mtime.
+        try:
+            return os.path.getmtime(self._attempt_path(symbol))
+        except OSError:
+            return None
+
+    def _mark_attempt(self, symbol):
+        os.makedirs(self._dir(symbol), exist_ok=True)
+        with open(self._attempt_path(symbol), 'a'): pass
+        os.utime(self._attempt_path(symbol))
+
+    def _lock(self, symbol):
+        with self._locks_guard:
+            lock = self._locks.get(symbol)
+            if lock is None:
+                os.makedirs(self._dir(symbol), exist_ok=True)
+                lock = self._locks[symbol] = FileLock(os.path.join(self._dir(symbol), ".lock"))
+            return lock
+
+    def _rows(self, symbol):
+        counts = []
+        for column, dtype in COLUMNS.items():
+            path = self._path(symbol, column)
+            counts.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        # A crash between column appends leaves ragged files; only complete rows are visible.
+        return min(counts)
+
+    def symbols(self):
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def read(self, symbol, columns=None):
+        rows = self._rows(symbol)
+        bars = {}
+        for column in columns or COLUMNS:
+            dtype = COLUMNS[column]
+            if rows == 0:
+                bars[column] = np.empty(0, dtype=dtype)
+            else:
+                bars[column] = np.memmap(self._path(symbol, column), dtype=dtype, mode='r', shape=(rows,))
+        return bars
+
+    def last_day(self, symbol):
+        rows = self._rows(symbol)
+        if rows == 0: return None
+        with open(self._path(symbol, 'date'), 'rb') as f:
+            f.seek((rows - 1) * np.dtype(COLUMNS['date']).itemsize)
+            return int(np.frombuffer(f.read(np.dtype(COLUMNS['date']).itemsize), dtype=COLUMNS['date'])[0])
+
+    def append(self, symbol, bars):
+        with self._lock(symbol):
+            rows = self._rows(symbol)
+            for column, dtype in COLUMNS.items():
+                path = self._path(symbol, column)
+                if os.path.exists(path) and os.path.getsize(path) != rows * np.dtype(dtype).itemsize:
+                    with open(path, 'r+b') as f:
+                        f.truncate(rows * np.dtype(dtype).itemsize)
+            last = self.last_day(symbol)
+            days = np.asarray(bars['date'], dtype=COLUMNS['date'])
+            keep = days > last if last is not None else np.ones(len(days), dtype=bool)
+            if not keep.any(): return 0
+            for column, dtype in COLUMNS.items():
+                with open(self._path(symbol, column), 'ab') as f:
+                    f.write(np.asarray(bars[column], dtype=dtype)[keep].tobytes())
+            return int(keep.sum())
+
+    def fetch_bars(self, symbol, start_day):
+        params = {'interval': '1d', 'period1': start_day * 86400, 'period2': int(datetime.now().timestamp()),
+                  'events': 'history'}
+        resp = http_client.get(f"{self.base_url}/v8/finance/chart/{symbol}", params=params, timeout=15,
+                               headers={'User-Agent': 'Mozilla/5.0'})
+        if resp.status_code != 200: return None
+        result = ((resp.json().get('chart') or {}).get('result') or [None])[0]
+        if not result or not result.get('timestamp'): return None
+        quote = result['indicators']['quote'][0]
+        now_et = datetime.now(US_EASTERN)
+        today = to_day(now_et.date())
+        rows = {column: [] for column in COLUMNS}
+        for i, ts in enumerate(result['timestamp']):
+            day = to_day(datetime.fromtimestamp(ts, US_EASTERN).date())
+            if quote['close'][i] is None or day < start_day: continue
+            if day >= today and now_et.time() < MARKET_CLOSE: continue
+            if rows['date'] and rows['date'][-1] == day: continue
+            rows['date'].append(day)
+            rows['close'].append(quote['close'][i])
+            for column in ('open', 'high', 'low'):
+                rows[column].append(quote[column][i] if quote[column][i] is not None else quote['close'][i])
+            rows['volume'].append(quote['volume'][i] or 0)
+        return rows
+
+    def update(self, symbol):
+        last = self.last_day(symbol)
+        start = last + 1 if last is not None else to_day(date.today()) - 365 * PRICE_HISTORY_YEARS
+        if start > to_day(date.today()): return 0
+        self._mark_attempt(symbol)
+        try:
+            bars = self.fetch_bars(symbol, start)
+        except Exception as e:
+            print(f"Error history {symbol}: {e}")
+            return 0
+        return self.append(symbol, bars) if bars else 0
+
+    def update_many(self, symbols, max_workers=8):
+        added = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.update, sym): sym for sym in symbols}
+            for future in concurrent.futures.as_completed(futures):
+                added[futures[future]] = future.result()
+        return added
+
+
+price_store = PriceStore()
@@ -0,0 +1,97 @@
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request, render_template
+from jinja2 import DictLoader, FileSystemBytecodeCache
+from markupsafe import Markup
+from config import DATA_DIR, FRAGMENT_CACHE_SIZE, COMPRESS_MIN_SIZE, COMPRESS_LEVEL
+from templates_html import TEMPLATES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEMPLATE_CACHE_DIR = os.path.join(DATA_DIR, "jinja_cache")
+COMPRESSIBLE = {'text/html', 'text/plain', 'text/csv', 'application/json', 'application/javascript'}
+
+
+class FragmentCache:
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, name, owner, version, render):
+        # One entry per (fragment, owner); a new version simply replaces the old one.
+        key = (name, owner)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = render()
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': (self.hits / lookups) if lookups else 0,
+                    'size': len(self._entries)}
+
+
+fragments = FragmentCache()
+
+
+def render_fragment(name, owner, version, **context):
+    return fragments.get(name, owner, version, lambda: Markup(render_template(name, **context)))
+
+
+def _encoding(size):
+    if size < COMPRESS_MIN_SIZE: return None
+    accepted = request.accept_encodings
+    if brotli and accepted['br']: return 'br'
+    if accepted['gzip']: return 'gzip'
+    return None
+
+
+def finalize_response(response):
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed: return response
+    if response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers: return response
+    body = response.get_data()
+    encoding = _encoding(len(body))
+    digest = hashlib.sha1(body).hexdigest()[:20]
+    response.vary.add('Accept-Encoding')
+    if not response.headers.get('Cache-Control'):
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    # Each encoding is a different representation, so it needs its own strong validator.
+    response.set_etag(f"{digest}-{encoding}" if encoding else digest)
+    response.make_conditional(request)
+    if response.status_code == 304 or not encoding: return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=min(COMPRESS_LEVEL, 11)))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_rendering(app):
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)}
+    app.jinja_loader = DictLoader(TEMPLATES)
+    # Compile every page once at startup instead of on the first request that needs it.
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)
+    app.after_request(finalize_response)
@@ -1,17 +1,29 @@
-import os
-import io
-import csv
-from flask import render_template_string, redirect, url_for, request, session, flash, make_response
+from flask import (render_template, redirect, url_for, request, session, flash, jsonify, Response,
+                   stream_with_context)
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
+import hmac
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, date
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-from config import MARKET_OPEN, MARKET_CLOSE, US_EASTERN, CRON_SECRET
-from models import load_users, save_users, get_safe_filename, load_json, save_json
-from utils import fetch_stock_price, fetch_batch_prices, fetch_stock_news_grouped, send_pushover
-from templates_html import LOGIN_PAGE, REGISTER_PAGE, DASHBOARD_PAGE, SETTINGS_PAGE
+from config import (US_EASTERN, CRON_SECRET, METRICS_TOKEN, ADMIN_USERS, PRICE_STREAM_MAX_SECONDS, HISTORY_PAGE_SIZE,
+                    RATELIMIT_STORAGE_URI, RATELIMIT_STRATEGY, API_RATE_LIMIT)
+import limiter_storage  # registers the sqlite:// limiter storage scheme
+from models import (load_users, get_user, edit_users, load_holdings, load_history, save_holdings, save_history,
+                    save_portfolio, delete_user_data, load_stats, history_version, history_page,
+                    load_lots, rebuild_lots, load_realized_lots)
+from exports import FORMATS, export_stream, bulk_export_stream
+from imports import import_trades
+from lots import METHODS as LOT_METHODS
+from notifications import run_notifications, dispatcher
+from portfolio import value_portfolio
+from streaming import stream_prices, sync_streams
+from valuation import valuation_cache
+from utils import fetch_stock_price, fetch_batch_prices, news_cache, quote_cache
+from rendering import fragments, render_fragment
+from metrics import metrics_response
 
 
 def register_routes(app):
@@ -19,8 +31,13 @@ def register_routes(app):
         get_remote_address,
         app=app,
         default_limits=["200 per day", "50 per hour"],
-        storage_uri="memory://"
+        storage_uri=RATELIMIT_STORAGE_URI,
+        strategy=RATELIMIT_STRATEGY
     )
+    # The dashboard's background calls would exhaust the per-IP default within a day, so they get their own
+    # per-user budget instead.
+    api_limit = limiter.shared_limit(API_RATE_LIMIT, scope='api',
+                                     key_func=lambda: session.get('user') or get_remote_address())
 
     def login_required(f):
         @wraps(f)
@@ -30,6 +47,15 @@ def register_routes(app):
 
         return decorated
 
+    def admin_required(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if 'user' not in session: return redirect(url_for('login'))
+            if session['user'] not in ADMIN_USERS: return "Forbidden", 403
+            return f(*args, **kwargs)
+
+        return decorated
+
     @app.route('/')
     def root():
         return redirect(url_for('dashboard')) if 'user' in session else redirect(url_for('login'))
@@ -38,118 +64,126 @@ def register_routes(app):
     @limiter.limit("5 per minute")
     def login():
         if request.method == 'POST':
-            users = load_users()
-            u = users.get(request.form.get('username'))
+            u = get_user(request.form.get('username'))
             if u and check_password_hash(u['hash'], request.form.get('password')):
                 session['user'] = request.form.get('username')
                 return redirect(url_for('dashboard'))
             flash("Invalid credentials", "danger")
-        return render_template_string(LOGIN_PAGE)
+        return render_template('login.html')
 
     @app.route('/register', methods=['GET', 'POST'])
     @limiter.limit("10 per hour")
     def register():
         if request.method == 'POST':
             n = request.form.get('username')
-            users = load_users()
-            if n not in users:
-                users[n] = {'hash': generate_password_hash(request.form.get('password')),
-                            'po_user': request.form.get('po_user'), 'notify_freq': 'none'}
-                save_users(users)
+            pw_hash = generate_password_hash(request.form.get('password'))
+            with edit_users() as users:
+                if n not in users:
+                    users[n] = {'hash': pw_hash, 'po_user': request.form.get('po_user'), 'notify_freq': 'none'}
             flash("Registration successful! Please log in.", "success")
             return redirect(url_for('login'))
-        return render_template_string(REGISTER_PAGE)
+        return render_template('register.html')
 
     @app.route('/logout')
     def logout():
         session.clear()
         return redirect(url_for('login'))
 
+    def _first_history_page(n):
+        rows, next_cursor = history_page(n, limit=HISTORY_PAGE_SIZE)
+        return Markup(render_template('history_rows.html', history=rows)), next_cursor
+
     @app.route('/dashboard')
     @login_required
     def dashboard():
-        h = load_json(get_safe_filename(session['user'], 'holdings'))
-        hist = load_json(get_safe_filename(session['user'], 'history'))
-
-        sell_txns = [t for t in hist if t.get('type') == 'SELL']
-        total_sells = len(sell_txns)
-        wins = len([t for t in sell_txns if t.get('realized_gain', 0) > 0])
-        win_rate = (wins / total_sells * 100) if total_sells > 0 else 0
-
-        total_realized = sum(txn.get('realized_gain', 0) or 0 for txn in hist if txn.get('realized_gain') is not None)
-        total_realized_cost_basis = sum(
-            txn.get('price', 0) * txn.get('qty', 0) for txn in hist if txn.get('type') == 'SELL')
-
-        tv, tc, tu = 0, 0, 0
-        daily_dollar_change = 0
-        previous_portfolio_val = 0
-
-        proc = []
-
-        symbols = list(set([s['symbol'] for s in h]))
-
+        n = session['user']
+        h = load_holdings(n)
+        news_cache.prefetch(list(dict.fromkeys(s['symbol'] for s in h)))
+        # The first history page is cached as rendered markup; later pages come from /api/history.
+        rows, next_cursor = fragments.get('history_rows.html', n, history_version(n), lambda: _first_history_page(n))
+        return render_template('dashboard.html', holdings=h, history_rows=rows, history_next=next_cursor,
+                               stats=load_stats(n))
+
+    @app.route('/api/history')
+    @api_limit
+    @login_required
+    def api_history():
+        f = request.args
+        try:
+            limit = max(1, min(f.get('limit', HISTORY_PAGE_SIZE, type=int), 200))
+            start, end = f.get('start') or None, f.get('end') or None
+            for d in (start, end):
+                if d: date.fromisoformat(d)
+            rows, next_cursor = history_page(session['user'], f.get('cursor') or None, limit,
+                                             f.get('symbol', '').upper().strip() or None,
+                                             f.get('type', '').upper() or None, start, end)
+        except ValueError as e:
+            return jsonify({'error': str(e) or "Invalid filter"}), 400
+        return jsonify({'rows': rows, 'next': next_cursor, 'html': render_template('history_rows.html', history=rows)})
+
+    @app.route('/api/portfolio')
+    @api_limit
+    @login_required
+    def api_portfolio():
+        h = load_holdings(session['user'])
+        symbols = list(dict.fromkeys(s['symbol'] for s in h))
         price_map = fetch_batch_prices(symbols)
+        result = value_portfolio(h, load_stats(session['user']), price_map, quote_cache.not_found(symbols))
+        result['as_of'] = datetime.now(US_EASTERN).isoformat(timespec='seconds')
+        return jsonify(result)
 
-        chart_labels = []
-        chart_data = []
-
-        for s in h:
-            data = price_map.get(s['symbol'])
-
-            if data:
-                curr = data['price']
-                prev = data['prev']
-                s['current_price'] = curr
-
-                val = curr * s['qty']
-                cost_basis = s['priceBought'] * s['qty']
-                unr = val - cost_basis
-
-                if prev:
-                    day_gain = (curr - prev) * s['qty']
-                    daily_dollar_change += day_gain
-                    previous_portfolio_val += (prev * s['qty'])
-
-                s['total_value'] = val
-                s['unrealised'] = unr
-                s['pct_change'] = ((curr - s['priceBought']) / s['priceBought']) * 100
-
-                tv += val
-                tc += cost_basis
-                tu += unr
+    @app.route('/api/lots')
+    @login_required
+    def api_lots():
+        ledger = load_lots(session['user'])
+        symbol = request.args.get('symbol', '').upper().strip()
+        realized = load_realized_lots(session['user'])
+        if symbol: realized = [r for r in realized if r['symbol'] == symbol]
+        lots = ledger.open_lots()
+        return jsonify({'method': ledger.method, 'open': {symbol: lots.get(symbol, [])} if symbol else lots,
+                        'realized': realized})
+
+    @app.route('/api/portfolio/history')
+    @api_limit
+    @login_required
+    def api_portfolio_history():
+        n = session['user']
+        return jsonify(valuation_cache.get(n, history_version(n), lambda: load_history(n)))
 
-                chart_labels.append(s['symbol'])
-                chart_data.append(round(val, 2))
-            else:
-                s['current_price'] = None
-                s['total_value'] = s['unrealised'] = s['pct_change'] = None
-
-            proc.append(s)
-
-        total_growth = total_realized + tu
-        lifetime_cost_basis = tc + total_realized_cost_basis
-        total_growth_pct = (total_growth / lifetime_cost_basis * 100) if lifetime_cost_basis > 0 else 0
-        daily_pct = (daily_dollar_change / previous_portfolio_val * 100) if previous_portfolio_val > 0 else 0
-
-        totals = {
-            'value': tv,
-            'unrealised': tu,
-            'pct': ((tv - tc) / tc * 100) if tc > 0 else 0,
-            'realized': total_realized,
-            'growth': total_growth,
-            'growth_pct': total_growth_pct,
-            'daily_val': daily_dollar_change,
-            'daily_pct': daily_pct,
-            'win_rate': win_rate,
-            'total_trades': total_sells
-        }
-
-        sorted_holdings = sorted(proc, key=lambda x: (x.get('total_value') or 0), reverse=True)
-        
-        news = fetch_stock_news_grouped(symbols)
-
-        return render_template_string(DASHBOARD_PAGE, holdings=sorted_holdings, history=hist, totals=totals, news=news,
-                                      chart_labels=chart_labels, chart_data=chart_data)
+    @app.route('/api/stream')
+    @api_limit
+    @login_required
+    def api_stream():
+        h = load_holdings(session['user'])
+        stats = load_stats(session['user'])
+
+        def render(prices):
+            result = value_portfolio(h, stats, prices, quote_cache.not_found(symbols))
+            result['as_of'] = datetime.now(US_EASTERN).isoformat(timespec='seconds')
+            return result
+
+        symbols = list(dict.fromkeys(s['symbol'] for s in h))
+        if not sync_streams.acquire(blocking=False):
+            return Response("Too many live streams, polling instead", 503, headers={'Retry-After': '60'})
+        response = Response(stream_with_context(stream_prices(symbols, render, PRICE_STREAM_MAX_SECONDS)),
+                            mimetype='text/event-stream')
+        # Runs when the server closes the response, including when the client has gone away.
+        response.call_on_close(sync_streams.release)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    @app.route('/api/news')
+    @api_limit
+    @login_required
+    def api_news():
+        h = load_holdings(session['user'])
+        symbols = list(dict.fromkeys(s['symbol'] for s in h))
+        news, pending = news_cache.get_many(symbols, wait=min(request.args.get('wait', 5, type=float), 10))
+        news = {sym: news[sym] for sym in symbols if sym in news}
+        html = render_fragment('news_panel.html', tuple(symbols), (news_cache.stamps(symbols), bool(pending)),
+                               news=news, pending=pending)
+        return jsonify({'news': news, 'pending': pending, 'html': html})
 
     @app.route('/trade', methods=['POST'])
     @login_required
@@ -166,15 +200,18 @@ def register_routes(app):
             flash("Invalid input numbers.", "danger")
             return redirect(url_for('dashboard'))
 
-        h_f, hist_f = get_safe_filename(n, 'holdings'), get_safe_filename(n, 'history')
-        h, hist = load_json(h_f), load_json(hist_f)
+        h = load_holdings(n)
+        txns = []
         idx = next((i for i, x in enumerate(h) if x['symbol'] == sym), -1)
 
         if act == 'buy':
             if idx == -1:
                 _, data = fetch_stock_price(sym)
                 if not data:
-                    flash("Ticker verification failed. Stock not found.", "danger")
+                    if sym in quote_cache.not_found([sym]):
+                        flash("Ticker verification failed. Stock not found.", "danger")
+                    else:
+                        flash("Could not reach the price service to verify this ticker. Try again shortly.", "danger")
                     return redirect(url_for('dashboard'))
 
             if idx >= 0:
@@ -184,64 +221,109 @@ def register_routes(app):
                 h[idx]['qty'] = new_qty
             else:
                 h.append({'symbol': sym, 'qty': qty, 'priceBought': price})
-            hist.append({'date': datetime.now().strftime("%Y-%m-%d %H:%M"), 'type': 'BUY', 'symbol': sym, 'qty': qty,
+            txns.append({'date': datetime.now().strftime("%Y-%m-%d %H:%M"), 'type': 'BUY', 'symbol': sym, 'qty': qty,
                          'price': price, 'realized_gain': None})
 
         elif act == 'sell':
+            lot_id = request.form.get('lot_id', type=int)
+            if lot_id is not None:
+                book = load_lots(n).books.get(sym)
+                lot = book.by_id.get(lot_id) if book else None
+                if not lot or lot.qty + 1e-9 < qty:
+                    flash(f"Lot #{lot_id} does not hold {qty:g} {sym}.", "danger")
+                    return redirect(url_for('dashboard'))
             if idx >= 0 and h[idx]['qty'] >= qty:
                 gain = (price - h[idx]['priceBought']) * qty
                 h[idx]['qty'] -= qty
                 if h[idx]['qty'] <= 1e-6: h.pop(idx)
-                hist.append(
-                    {'date': datetime.now().strftime("%Y-%m-%d %H:%M"), 'type': 'SELL', 'symbol': sym, 'qty': qty,
-                     'price': price, 'realized_gain': gain})
+                txn = {'date': datetime.now().strftime("%Y-%m-%d %H:%M"), 'type': 'SELL', 'symbol': sym, 'qty': qty,
+                       'price': price, 'realized_gain': gain}
+                if lot_id is not None: txn['lot_id'] = lot_id
+                txns.append(txn)
             else:
                 flash("Insufficient quantity.", "danger")
 
-        save_json(h_f, h);
-        save_json(hist_f, hist)
+        save_portfolio(n, h, txns)
         return redirect(url_for('dashboard'))
 
     @app.route('/settings', methods=['GET', 'POST'])
     @login_required
     def settings():
         n = session['user']
-        users = load_users()
         if request.method == 'POST':
-            users[n]['po_user'] = request.form.get('po_user')
-            users[n]['notify_freq'] = request.form.get('notify_freq')
-            save_users(users)
+            method = request.form.get('lot_method', 'fifo')
+            if method not in LOT_METHODS: method = 'fifo'
+            with edit_users() as users:
+                users[n]['po_user'] = request.form.get('po_user')
+                users[n]['notify_freq'] = request.form.get('notify_freq')
+                changed = users[n].get('lot_method', 'fifo') != method
+                users[n]['lot_method'] = method
+            if changed: rebuild_lots(n, method)
             flash("Saved", "success")
-        return render_template_string(SETTINGS_PAGE, user=users[n])
+        return render_template('settings.html', user=get_user(n))
 
     @app.route('/export_data')
     @login_required
     def export_data():
         n = session['user']
-        holdings = load_json(get_safe_filename(n, 'holdings'))
-        history = load_json(get_safe_filename(n, 'history'))
-        si = io.StringIO()
-        cw = csv.writer(si)
-        cw.writerow(["--- CURRENT HOLDINGS ---"])
-        cw.writerow(["Symbol", "Qty", "Avg Price"])
-        for x in holdings: cw.writerow([x['symbol'], x['qty'], x['priceBought']])
-        cw.writerow([])
-        cw.writerow(["--- TRANSACTION HISTORY ---"])
-        cw.writerow(["Date", "Type", "Symbol", "Qty", "Price", "Realized Gain"])
-        for x in history: cw.writerow(
-            [x['date'], x['type'], x['symbol'], x['qty'], x['price'], x.get('realized_gain', '-')])
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = f"attachment; filename=stock_data_{n}.csv"
-        output.headers["Content-type"] = "text/csv"
+        fmt = request.args.get('format', 'csv')
+        if fmt not in FORMATS: return "Unknown export format", 400
+        mimetype, ext = FORMATS[fmt]
+        output = Response(stream_with_context(export_stream(n, fmt)), mimetype=mimetype)
+        output.headers["Content-Disposition"] = f"attachment; filename=stock_data_{n}.{ext}"
+        return output
+
+    @app.route('/admin/export_all')
+    @admin_required
+    def export_all():
+        stamp = datetime.now(US_EASTERN).strftime("%Y%m%d_%H%M")
+        output = Response(stream_with_context(bulk_export_stream()), mimetype='application/zip')
+        output.headers["Content-Disposition"] = f"attachment; filename=stocktracker_export_{stamp}.zip"
         return output
 
+    def _run_import():
+        upload = request.files.get('file')
+        if not upload or not upload.filename: raise ValueError("No file uploaded")
+        return import_trades(session['user'], upload.stream, upload.filename,
+                             partial=request.values.get('partial') in ('1', 'on', 'true'))
+
+    @app.route('/api/import', methods=['POST'])
+    @login_required
+    @limiter.limit("20 per hour")
+    def api_import():
+        try:
+            return jsonify(_run_import())
+        except ValueError as e:
+            return jsonify({'committed': False, 'imported': 0, 'errors': [{'line': 0, 'error': str(e)}]}), 400
+
+    @app.route('/import_data', methods=['POST'])
+    @login_required
+    @limiter.limit("20 per hour")
+    def import_data():
+        try:
+            report = _run_import()
+        except ValueError as e:
+            flash(f"Import failed: {e}", "danger")
+            return redirect(url_for('settings'))
+        errors = report['errors']
+        details = "; ".join(f"line {e['line']}: {e['error']}" for e in errors[:5])
+        if len(errors) > 5: details += f"; and {len(errors) - 5} more"
+        if report['committed']:
+            flash(f"Imported {report['imported']} transactions." + (f" Skipped: {details}" if errors else ""),
+                  "warning" if errors else "success")
+        elif errors:
+            flash(f"Nothing imported, {len(errors)} rows have errors: {details}", "danger")
+        else:
+            flash("No transactions found in the file.", "warning")
+        return redirect(url_for('settings'))
+
     @app.route('/wipe_portfolio', methods=['POST'])
     @login_required
     def wipe_portfolio():
         n = session['user']
         try:
-            save_json(get_safe_filename(n, 'holdings'), [])
-            save_json(get_safe_filename(n, 'history'), [])
+            save_holdings(n, [])
+            save_history(n, [])
             flash("All holdings and history wiped.", "warning")
         except Exception as e:
             flash(f"Error wiping: {e}", "danger")
@@ -252,13 +334,11 @@ def register_routes(app):
     def delete_account():
         n = session['user']
         try:
-            h_f, hist_f = get_safe_filename(n, 'holdings'), get_safe_filename(n, 'history')
-            if os.path.exists(h_f): os.remove(h_f)
-            if os.path.exists(hist_f): os.remove(hist_f)
+            delete_user_data(n)
         except:
             pass
-        users = load_users()
-        if n in users: del users[n]; save_users(users)
+        with edit_users() as users:
+            users.pop(n, None)
         session.clear()
         flash("Account deleted.", "info")
         return redirect(url_for('login'))
@@ -266,63 +346,27 @@ def register_routes(app):
     @app.route('/test_notification', methods=['POST'])
     @login_required
     def test_notification():
-        users = load_users()
-        u = users[session['user']]
-        if send_pushover(u.get('po_user'), "Test Notification Success"):
-            flash("Sent!", "success")
+        u = get_user(session['user'])
+        if dispatcher.enqueue(u.get('po_user'), "Test Notification Success"):
+            flash("Queued! It should arrive in a few seconds.", "success")
         else:
             flash("Failed", "danger")
         return redirect(url_for('settings'))
 
+    @app.route('/metrics')
+    @limiter.exempt
+    def metrics():
+        if METRICS_TOKEN:
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+                return "Unauthorized", 401
+        elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+            # Without a token only a scraper on the same host gets in; requests relayed by a local proxy don't.
+            return "Not Found", 404
+        return metrics_response()
+
     @app.route('/cron/trigger')
     def cron_trigger():
         if request.args.get("secret") != CRON_SECRET:
             return "Unauthorized", 401
-            
-        now_et = datetime.now(US_EASTERN)
-        current_time = now_et.time()
-
-        def is_time_match(th, tm):
-            nm = current_time.hour * 60 + current_time.minute
-            tm_mins = th * 60 + tm
-            return tm_mins <= nm < (tm_mins + 30)
-
-        is_open = MARKET_OPEN <= current_time <= MARKET_CLOSE
-
-        users = load_users()
-        sent = 0
-        for u, d in users.items():
-            freq = d.get('notify_freq', 'none')
-            if freq == 'none': continue
-            do_send = False
-            if freq == 'open' and is_time_match(9, 30):
-                do_send = True
-            elif freq == 'open_close' and (is_time_match(9, 30) or is_time_match(15, 30)):
-                do_send = True
-            elif freq == 'hourly' and is_open and current_time.minute < 30:
-                do_send = True
-            elif freq == '2hours' and is_open and (current_time.hour % 2 != 0) and current_time.minute < 30:
-                do_send = True
-
-            if do_send:
-                holdings = load_json(get_safe_filename(u, 'holdings'))
-                if not holdings: continue
-
-                symbols = [h['symbol'] for h in holdings]
-                price_map = fetch_batch_prices(symbols)
-
-                tv, tu = 0, 0
-                daily_moves = {}
-                for h in holdings:
-                    data = price_map.get(h['symbol'])
-                    if data:
-                        c = data['price']
-                        prev = data['prev']
-                        tv += c * h['qty']
-                        tu += (c - h['priceBought']) * h['qty']
-                        if prev:
-                            daily_moves[h['symbol']] = ((c - prev) / prev) * 100
-
-                mover = f"{max(daily_moves, key=lambda k: abs(daily_moves[k]))} {daily_moves[max(daily_moves, key=lambda k: abs(daily_moves[k]))]:.2f}%" if daily_moves else "N/A"
-                if send_pushover(d.get('po_user'), f"Update: Val ${tv:,.0f} | P/L ${tu:,.0f} | Top: {mover}"): sent += 1
-        return f"Processed {sent}"
\ No newline at end of file
+
+        return jsonify(run_notifications(load_users()))
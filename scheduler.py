@@ -0,0 +1,136 @@
+import os
+import json
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+from config import DATA_DIR, US_EASTERN, NOTIFY_GRACE_MINUTES, SCHEDULER_POLL_SECONDS, SCHEDULE_CHANGES_FILE
+from locks import FileLock
+from models import load_users
+from notifications import next_slot, run_notifications, notify_state
+
+LEADER_LOCK_FILE = os.path.join(DATA_DIR, "scheduler.lock")
+LEADER_RETRY_SECONDS = 30
+
+
+class Scheduler:
+    def __init__(self, poll_seconds=SCHEDULER_POLL_SECONDS, notify=run_notifications,
+                 changes_file=SCHEDULE_CHANGES_FILE, state=notify_state):
+        self.poll_seconds = poll_seconds
+        self.notify = notify
+        self.changes_file = changes_file
+        self.state = state
+        self._heap = []
+        self._freqs = {}
+        self._slots = {}
+        self._offset = None
+        self.last_report = None
+
+    def load(self, now_et):
+        # Full scan once at startup. The journal is emptied first, so anything written to it afterwards is replayed
+        # on top of this load, and anything written before it is already in the users store.
+        with open(self.changes_file, 'w'):
+            pass
+        self._offset = 0
+        self._heap, self._freqs, self._slots = [], {}, {}
+        last_sent = self.state.load()
+        for name, u in load_users().items():
+            self.update(name, u.get('notify_freq', 'none'), now_et, last_sent)
+
+    def update(self, name, freq, now_et, last_sent=None):
+        # Start from the grace window so a slot that has just passed is still picked up once, but never from before
+        # the last slot this user was already sent.
+        last_sent = self.state.load() if last_sent is None else last_sent
+        since = now_et - timedelta(minutes=NOTIFY_GRACE_MINUTES)
+        if last_sent.get(name):
+            since = max(since, datetime.fromtimestamp(last_sent[name], US_EASTERN))
+        self._reschedule(name, freq, since)
+
+    def _reschedule(self, name, freq, after_et):
+        # Superseded heap entries stay in place and are skipped when popped.
+        slot = next_slot(freq, after_et)
+        self._freqs[name] = freq
+        if slot:
+            self._slots[name] = slot.timestamp()
+            heapq.heappush(self._heap, (slot.timestamp(), name))
+        else:
+            self._slots.pop(name, None)
+
+    def read_changes(self, now_et):
+        try:
+            with open(self.changes_file, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only whole lines; a writer may be halfway through the last one.
+        data = data[:data.rfind(b'\n') + 1]
+        if not data: return
+        self._offset += len(data)
+        changes = {}
+        for line in data.decode().splitlines():
+            try:
+                change = json.loads(line)
+                changes[change['user']] = change['freq']
+            except (ValueError, KeyError, TypeError):
+                continue
+        last_sent = self.state.load()
+        for name, freq in changes.items():
+            self.update(name, freq, now_et, last_sent)
+
+    def tick(self, now_et=None):
+        now_et = now_et or datetime.now(US_EASTERN)
+        if self._offset is None:
+            self.load(now_et)
+        else:
+            self.read_changes(now_et)
+        now_ts = now_et.timestamp()
+        due = {}
+        while self._heap and self._heap[0][0] <= now_ts:
+            ts, name = heapq.heappop(self._heap)
+            if self._slots.get(name) == ts:
+                due[name] = True
+        if due:
+            users = load_users()
+            self.last_report = self.notify({name: users[name] for name in due if name in users}, now_et)
+            # Dispatched slots are never queued again, even if the message later fails; the notify state lets a
+            # cron call or restart within the grace window pick those up.
+            for name in due:
+                self._reschedule(name, self._freqs.get(name), now_et)
+        return self.seconds_until_next(now_ts)
+
+    def seconds_until_next(self, now_ts):
+        wait = self.poll_seconds
+        if self._heap:
+            wait = min(wait, self._heap[0][0] - now_ts)
+        return max(1.0, wait)
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                wait = self.tick()
+            except Exception as e:
+                print(f"Scheduler error: {e}")
+                wait = LEADER_RETRY_SECONDS
+            stop_event.wait(wait)
+
+
+def lead_and_run(stop_event, lock_path=LEADER_LOCK_FILE):
+    leader = FileLock(lock_path)
+    while not stop_event.is_set():
+        if leader.acquire(blocking=False):
+            print(f"Notification scheduler running in process {os.getpid()}")
+            try:
+                Scheduler().run(stop_event)
+            finally:
+                leader.release()
+            return
+        stop_event.wait(LEADER_RETRY_SECONDS)
+
+
+def start_scheduler(lock_path=LEADER_LOCK_FILE):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=lead_and_run, args=(stop_event, lock_path), name='scheduler', daemon=True)
+    thread.start()
+    return stop_event
+
@@ -0,0 +1,313 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from portfolio import apply_txn_stats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    po_user TEXT,
+    notify_freq TEXT NOT NULL DEFAULT 'none',
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_users_notify_freq ON users (notify_freq);
+
+CREATE TABLE IF NOT EXISTS holdings (
+    username TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    qty REAL NOT NULL,
+    price_bought REAL NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (username, symbol)
+);
+CREATE INDEX IF NOT EXISTS idx_holdings_symbol ON holdings (symbol);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    qty REAL NOT NULL,
+    price REAL NOT NULL,
+    realized_gain REAL,
+    lot_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (username, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_symbol ON transactions (username, symbol, id);
+
+CREATE TABLE IF NOT EXISTS lots (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS lot_gains (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lot_gains_user ON lot_gains (username, id);
+
+CREATE TABLE IF NOT EXISTS aggregates (
+    username TEXT PRIMARY KEY,
+    txn_count INTEGER NOT NULL,
+    total_sells INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    realized REAL NOT NULL,
+    realized_cost_basis REAL NOT NULL
+);
+"""
+
+AGGREGATE_COLUMNS = ('txn_count', 'total_sells', 'wins', 'realized', 'realized_cost_basis')
+
+USER_COLUMNS = ('hash', 'po_user', 'notify_freq')
+
+TXN_COLUMNS = "date, type, symbol, qty, price, realized_gain, lot_id"
+
+
+def _user(row):
+    user = json.loads(row['extra'] or '{}')
+    user.update({col: row[col] for col in USER_COLUMNS})
+    return user
+
+
+def _txn(row):
+    txn = {k: row[k] for k in ('date', 'type', 'symbol', 'qty', 'price', 'realized_gain')}
+    if row['lot_id'] is not None: txn['lot_id'] = row['lot_id']
+    return txn
+
+
+class SqliteStorage:
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = self._connect()
+        db.executescript(SCHEMA)
+        if 'lot_id' not in {r['name'] for r in db.execute("PRAGMA table_info(transactions)")}:
+            db.execute("ALTER TABLE transactions ADD COLUMN lot_id INTEGER")
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _read_users(self, db):
+        users = {}
+        for row in db.execute("SELECT * FROM users ORDER BY rowid"):
+            users[row['username']] = _user(row)
+        return users
+
+    def load_users(self):
+        return self._read_users(self._connect())
+
+    def get_user(self, username):
+        row = self._connect().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return _user(row) if row is not None else None
+
+    @contextmanager
+    def edit_users(self):
+        # Read and write under one write lock, and only touch the accounts the caller changed, so concurrent
+        # registrations and settings saves never undo each other.
+        with self.transaction() as db:
+            users = self._read_users(db)
+            before = copy.deepcopy(users)
+            yield users
+            db.executemany("DELETE FROM users WHERE username = ?", [(name,) for name in before if name not in users])
+            self._upsert_users(db, {name: u for name, u in users.items() if before.get(name) != u})
+
+    def save_users(self, users):
+        with self.transaction() as db:
+            existing = {row[0] for row in db.execute("SELECT username FROM users")}
+            for name in existing - set(users):
+                db.execute("DELETE FROM users WHERE username = ?", (name,))
+            self._upsert_users(db, users)
+
+    def _upsert_users(self, db, users):
+        db.executemany(
+            "INSERT INTO users (username, hash, po_user, notify_freq, extra) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET hash = excluded.hash, po_user = excluded.po_user, "
+            "notify_freq = excluded.notify_freq, extra = excluded.extra",
+            [(name, u.get('hash'), u.get('po_user'), u.get('notify_freq') or 'none',
+              json.dumps({k: v for k, v in u.items() if k not in USER_COLUMNS}))
+             for name, u in users.items()])
+
+    def load_holdings(self, username):
+        rows = self._connect().execute(
+            "SELECT symbol, qty, price_bought FROM holdings WHERE username = ? ORDER BY position", (username,))
+        return [{'symbol': r['symbol'], 'qty': r['qty'], 'priceBought': r['price_bought']} for r in rows]
+
+    def save_holdings(self, username, holdings):
+        with self.transaction() as db:
+            self._write_holdings(db, username, holdings)
+
+    def _write_holdings(self, db, username, holdings):
+        db.execute("DELETE FROM holdings WHERE username = ?", (username,))
+        db.executemany("INSERT INTO holdings (username, symbol, qty, price_bought, position) VALUES (?, ?, ?, ?, ?)",
+                       [(username, h['symbol'], h['qty'], h['priceBought'], i) for i, h in enumerate(holdings)])
+
+    def load_history(self, username):
+        rows = self._connect().execute(
+            "SELECT " + TXN_COLUMNS + " FROM transactions WHERE username = ? ORDER BY id",
+            (username,))
+        return [_txn(r) for r in rows]
+
+    def iter_history(self, username, reverse=False):
+        order = 'DESC' if reverse else 'ASC'
+        cursor = self._connect().execute(
+            "SELECT " + TXN_COLUMNS + " FROM transactions WHERE username = ? "
+            f"ORDER BY id {order}", (username,))
+        for row in cursor:
+            yield _txn(row)
+
+    def tail_history(self, username, n):
+        rows = self._connect().execute(
+            "SELECT " + TXN_COLUMNS + " FROM transactions WHERE username = ? "
+            "ORDER BY id DESC LIMIT ?", (username, n))
+        return [_txn(r) for r in reversed(rows.fetchall())]
+
+    def history_page(self, username, cursor=None, limit=50, symbol=None, txn_type=None, start=None, end=None):
+        where, args = ["username = ?"], [username]
+        if cursor:
+            where.append("id < ?")
+            args.append(int(cursor))
+        if symbol:
+            where.append("symbol = ?")
+            args.append(symbol)
+        if txn_type:
+            where.append("type = ?")
+            args.append(txn_type)
+        if start:
+            where.append("substr(date, 1, 10) >= ?")
+            args.append(start)
+        if end:
+            where.append("substr(date, 1, 10) <= ?")
+            args.append(end)
+        rows = self._connect().execute(
+            "SELECT id, " + TXN_COLUMNS + " FROM transactions WHERE "
+            f"{' AND '.join(where)} ORDER BY id DESC LIMIT ?", args + [limit]).fetchall()
+        records = [_txn(r) for r in rows]
+        return records, (str(rows[-1]['id']) if len(rows) == limit else None)
+
+    def history_version(self, username):
+        row = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM transactions WHERE username = ?", (username,)).fetchone()
+        return f"{row[0]:x}-{row[1]:x}"
+
+    def compact_history(self, username):
+        return 0
+
+    def save_history(self, username, history):
+        with self.transaction() as db:
+            db.execute("DELETE FROM transactions WHERE username = ?", (username,))
+            self._write_history(db, username, history)
+            self._rebuild_aggregates(db, username)
+
+    def append_history(self, username, txns):
+        with self.transaction() as db:
+            self._write_history(db, username, txns)
+
+    def _write_history(self, db, username, txns):
+        db.executemany(
+            "INSERT INTO transactions (username, date, type, symbol, qty, price, realized_gain, lot_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(username, t['date'], t['type'], t['symbol'], t['qty'], t['price'], t.get('realized_gain'), t.get('lot_id'))
+             for t in txns])
+
+    def _read_aggregates(self, db, username):
+        row = db.execute(f"SELECT {', '.join(AGGREGATE_COLUMNS)} FROM aggregates WHERE username = ?",
+                         (username,)).fetchone()
+        if row is None: return None
+        agg = dict(row)
+        agg['win_rate'] = (agg['wins'] / agg['total_sells'] * 100) if agg['total_sells'] > 0 else 0
+        return agg
+
+    def _write_aggregates(self, db, username, agg):
+        db.execute(f"INSERT OR REPLACE INTO aggregates (username, {', '.join(AGGREGATE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                   (username,) + tuple(agg[col] for col in AGGREGATE_COLUMNS))
+
+    def _rebuild_aggregates(self, db, username):
+        db.execute(
+            "INSERT OR REPLACE INTO aggregates (username, txn_count, total_sells, wins, realized, realized_cost_basis) "
+            "SELECT ?, COUNT(*), "
+            "COALESCE(SUM(type = 'SELL'), 0), "
+            "COALESCE(SUM(type = 'SELL' AND COALESCE(realized_gain, 0) > 0), 0), "
+            "COALESCE(SUM(COALESCE(realized_gain, 0)), 0), "
+            "COALESCE(SUM(CASE WHEN type = 'SELL' THEN price * qty ELSE 0 END), 0) "
+            "FROM transactions WHERE username = ?", (username, username))
+        return self._read_aggregates(db, username)
+
+    def load_aggregates(self, username):
+        return self._read_aggregates(self._connect(), username)
+
+    def rebuild_aggregates(self, username):
+        with self.transaction() as db:
+            return self._rebuild_aggregates(db, username)
+
+    def load_lots(self, username):
+        row = self._connect().execute("SELECT data FROM lots WHERE username = ?", (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_lots(self, username, data, realized, replace=False):
+        with self.transaction() as db:
+            if replace:
+                db.execute("DELETE FROM lot_gains WHERE username = ?", (username,))
+            db.executemany("INSERT INTO lot_gains (username, data) VALUES (?, ?)",
+                           [(username, json.dumps(r, separators=(',', ':'))) for r in realized])
+            db.execute("INSERT OR REPLACE INTO lots (username, data) VALUES (?, ?)",
+                       (username, json.dumps(data, separators=(',', ':'))))
+
+    def load_realized_lots(self, username):
+        rows = self._connect().execute("SELECT data FROM lot_gains WHERE username = ? ORDER BY id", (username,))
+        return [json.loads(r[0]) for r in rows]
+
+    def save_portfolio(self, username, holdings, txns):
+        with self.transaction() as db:
+            self._write_holdings(db, username, holdings)
+            if not txns: return
+            self._write_history(db, username, txns)
+            agg = self._read_aggregates(db, username)
+            if agg is None:
+                self._rebuild_aggregates(db, username)
+                return
+            for txn in txns:
+                apply_txn_stats(agg, txn)
+            self._write_aggregates(db, username, agg)
+
+    def replace_user_data(self, username, holdings, history):
+        with self.transaction() as db:
+            db.execute("DELETE FROM transactions WHERE username = ?", (username,))
+            self._write_holdings(db, username, holdings)
+            self._write_history(db, username, history)
+            self._rebuild_aggregates(db, username)
+
+    def delete_user_data(self, username):
+        with self.transaction() as db:
+            db.execute("DELETE FROM holdings WHERE username = ?", (username,))
+            db.execute("DELETE FROM transactions WHERE username = ?", (username,))
+            db.execute("DELETE FROM aggregates WHERE username = ?", (username,))
+            db.execute("DELETE FROM lots WHERE username = ?", (username,))
+            db.execute("DELETE FROM lot_gains WHERE username = ?", (username,))
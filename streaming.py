@@ -0,0 +1,157 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from config import PRICE_STREAM_INTERVAL, PRICE_STREAM_THREADS
+from utils import fetch_batch_prices
+
+
+class Subscription:
+    def __init__(self, poller, symbols, loop=None):
+        self.poller = poller
+        self.symbols = frozenset(symbols)
+        self.updates = queue.Queue(maxsize=1)
+        # Set for subscribers on an event loop; the poller thread wakes them through the loop.
+        self.loop = loop
+        self._ready = asyncio.Event() if loop else None
+
+    def push(self, prices):
+        try:
+            self.updates.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.updates.put_nowait(prices)
+        except queue.Full:
+            pass
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                pass
+
+    def get(self, timeout):
+        try:
+            return self.updates.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        try:
+            return self.updates.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.poller.unsubscribe(self)
+
+
+class PricePoller:
+    def __init__(self, interval=PRICE_STREAM_INTERVAL, fetch=fetch_batch_prices):
+        self.interval = interval
+        self.fetch = fetch
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._latest = {}
+        self._thread = None
+        self._wake = threading.Event()
+        self.polls = 0
+
+    def subscribe(self, symbols, loop=None):
+        sub = Subscription(self, symbols, loop)
+        with self._lock:
+            self._subscribers.add(sub)
+            snapshot = {sym: self._latest[sym] for sym in sub.symbols if sym in self._latest}
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='price-poller', daemon=True)
+                self._thread.start()
+            elif sub.symbols - self._latest.keys():
+                self._wake.set()
+        if snapshot:
+            sub.push(snapshot)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+                symbols = set().union(*(sub.symbols for sub in self._subscribers))
+            try:
+                prices = self.fetch(sorted(symbols))
+            except Exception as e:
+                print(f"Price poller error: {e}")
+                prices = {}
+            with self._lock:
+                self.polls += 1
+                changed = {sym for sym, data in prices.items() if self._latest.get(sym) != data}
+                self._latest.update(prices)
+                for sym in set(self._latest) - symbols:
+                    del self._latest[sym]
+                subscribers = list(self._subscribers)
+                latest = dict(self._latest)
+            for sub in subscribers:
+                if sub.symbols & changed:
+                    sub.push({sym: latest[sym] for sym in sub.symbols if sym in latest})
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'symbols': len(self._latest),
+                'polls': self.polls,
+                'running': self._thread is not None
+            }
+
+
+price_poller = PricePoller()
+# Under a WSGI server each open stream holds a worker thread for up to PRICE_STREAM_MAX_SECONDS, so only this many
+# run at once per process; further tabs get a 503 and fall back to polling. asgi:app streams on the event loop instead.
+sync_streams = threading.BoundedSemaphore(PRICE_STREAM_THREADS)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_prices(symbols, render, max_seconds, heartbeat=15):
+    sub = price_poller.subscribe(symbols)
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield "retry: 5000\n\n"
+        while time.monotonic() < deadline:
+            prices = sub.get(timeout=heartbeat)
+            if prices is None:
+                yield ": ping\n\n"
+                continue
+            yield sse_event('portfolio', render(prices))
+    finally:
+        sub.close()
+
+
+async def astream_prices(symbols, render, max_seconds, heartbeat=15):
+    sub = price_poller.subscribe(symbols, asyncio.get_running_loop())
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield "retry: 5000\n\n"
+        while time.monotonic() < deadline:
+            prices = await sub.aget(min(heartbeat, max(0.0, deadline - time.monotonic())))
+            if prices is None:
+                yield ": ping\n\n"
+                continue
+            yield sse_event('portfolio', render(prices))
+    finally:
+        sub.close()
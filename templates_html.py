@@ -109,12 +109,28 @@ SETTINGS_PAGE = BASE_LAYOUT.replace("{% block content %}{% endblock %}", """
                 <option value="2hours" {% if user.notify_freq == '2hours' %}selected{% endif %}>Every 2 Hours (While Market is Open)</option>
             </select>
         </div>
+        <h5 class="mb-3">Tax Lots</h5>
+        <div class="mb-4">
+            <select name="lot_method" class="form-select">
+                <option value="fifo" {% if user.lot_method != 'lifo' %}selected{% endif %}>First In, First Out (FIFO)</option>
+                <option value="lifo" {% if user.lot_method == 'lifo' %}selected{% endif %}>Last In, First Out (LIFO)</option>
+            </select>
+            <div class="form-text">Which lots a sell consumes unless a specific lot is chosen. Changing this recalculates your lots from history.</div>
+        </div>
         <button type="submit" class="btn btn-primary w-100 py-2 fw-bold">Save Changes</button>
     </form>
     <div class="mt-4 d-flex gap-2">
         <form action="{{ url_for('test_notification') }}" method="POST" class="flex-grow-1"><button class="btn btn-warning w-100">Send Test Notification</button></form>
         <a href="{{ url_for('export_data') }}" class="btn btn-secondary flex-grow-1 text-center text-decoration-none lh-lg">Export Data (CSV)</a>
     </div>
+    <p class="small text-muted mt-2 mb-0 text-end">Also as <a href="{{ url_for('export_data', format='csv.gz') }}">CSV (gzip)</a>, <a href="{{ url_for('export_data', format='jsonl') }}">JSON Lines</a> or <a href="{{ url_for('export_data', format='jsonl.gz') }}">JSON Lines (gzip)</a></p>
+    <form action="{{ url_for('import_data') }}" method="POST" enctype="multipart/form-data" class="mt-3 p-3 border rounded">
+        <label class="form-label fw-bold">Import Trades</label>
+        <input type="file" name="file" accept=".csv,.jsonl,.gz" class="form-control mb-2" required>
+        <div class="form-check mb-2"><input class="form-check-input" type="checkbox" name="partial" id="importPartial"><label class="form-check-label small" for="importPartial">Import valid rows even if some rows have errors</label></div>
+        <p class="small text-muted">CSV or JSON Lines in the export format, optionally gzipped. Rows are applied in date order on top of your current holdings.</p>
+        <button class="btn btn-outline-primary w-100">Import</button>
+    </form>
     <hr class="my-4">
     <div class="p-3 bg-light border rounded">
         <h5 class="text-danger">Danger Zone</h5>
@@ -130,22 +146,18 @@ SETTINGS_PAGE = BASE_LAYOUT.replace("{% block content %}{% endblock %}", """
 """)
 
 DASHBOARD_PAGE = BASE_LAYOUT.replace("{% block content %}{% endblock %}", """
-<h5 class="mb-3 text-secondary">Today's Performance</h5>
+<h5 class="mb-3 text-secondary">Today's Performance <small id="asOf" class="text-muted fw-normal ms-2"></small></h5>
 <div class="row mb-4 text-center">
     <div class="col-md-12">
-        <div class="card p-3 border-start border-4 {{ 'border-success' if totals.daily_val >= 0 else 'border-danger' }}">
+        <div class="card p-3 border-start border-4" data-metric-card="daily_val">
             <div class="d-flex justify-content-between align-items-center px-4">
                 <div>
                     <div class="metric-label">Today's Change ($)</div>
-                    <div class="metric-value {{ 'text-profit' if totals.daily_val >= 0 else 'text-loss' }}">
-                        ${{ "{:,.2f}".format(totals.daily_val) }}
-                    </div>
+                    <div class="metric-value" data-metric="daily_val" data-format="money">...</div>
                 </div>
                 <div>
                     <div class="metric-label">Today's Change (%)</div>
-                    <div class="metric-value {{ 'text-profit' if totals.daily_pct >= 0 else 'text-loss' }}">
-                        {{ "{:,.2f}".format(totals.daily_pct) }}%
-                    </div>
+                    <div class="metric-value" data-metric="daily_pct" data-format="pct">...</div>
                 </div>
             </div>
         </div>
@@ -154,9 +166,9 @@ DASHBOARD_PAGE = BASE_LAYOUT.replace("{% block content %}{% endblock %}", """
 
 <h5 class="mb-3 text-secondary">Current Portfolio</h5>
 <div class="row mb-4 text-center">
-    <div class="col-md-4 mb-3"><div class="card p-4 h-100 border-start border-4 border-dark"><div class="metric-label">Portfolio Value</div><div class="metric-value text-dark">${{ "{:,.2f}".format(totals.value) }}</div></div></div>
-    <div class="col-md-4 mb-3"><div class="card p-4 h-100 border-start border-4 {{ 'border-success' if totals.unrealised >= 0 else 'border-danger' }}"><div class="metric-label">Unrealized P/L ($)</div><div class="metric-value {{ 'text-profit' if totals.unrealised >= 0 else 'text-loss' }}">${{ "{:,.2f}".format(totals.unrealised) }}</div></div></div>
-    <div class="col-md-4 mb-3"><div class="card p-4 h-100 border-start border-4 {{ 'border-success' if totals.pct >= 0 else 'border-danger' }}"><div class="metric-label">Unrealized Growth (%)</div><div class="metric-value {{ 'text-profit' if totals.pct >= 0 else 'text-loss' }}">{{ "{:,.2f}".format(totals.pct) }}%</div></div></div>
+    <div class="col-md-4 mb-3"><div class="card p-4 h-100 border-start border-4 border-dark"><div class="metric-label">Portfolio Value</div><div class="metric-value text-dark" data-metric="value" data-format="money" data-unsigned="1">...</div></div></div>
+    <div class="col-md-4 mb-3"><div class="card p-4 h-100 border-start border-4" data-metric-card="unrealised"><div class="metric-label">Unrealized P/L ($)</div><div class="metric-value" data-metric="unrealised" data-format="money">...</div></div></div>
+    <div class="col-md-4 mb-3"><div class="card p-4 h-100 border-start border-4" data-metric-card="pct"><div class="metric-label">Unrealized Growth (%)</div><div class="metric-value" data-metric="pct" data-format="pct">...</div></div></div>
 </div>
 
 <div class="row mb-4">
@@ -178,16 +190,16 @@ DASHBOARD_PAGE = BASE_LAYOUT.replace("{% block content %}{% endblock %}", """
             <div class="table-responsive">
                 <table class="table table-hover align-middle">
                     <thead class="table-light"><tr><th>Symbol</th><th>Qty</th><th>Avg Cost</th><th>Price</th><th>Value</th><th>Return</th><th>Action</th></tr></thead>
-                    <tbody>
+                    <tbody id="holdingsBody">
                         {% for s in holdings %}
                         <tr>
                             <td class="fw-bold">{{ s.symbol }}</td>
                             <td>{{ "{:,.4f}".format(s.qty) }}</td>
                             <td>${{ "{:,.2f}".format(s.priceBought) }}</td>
-                            <td>{{ "${:,.2f}".format(s.current_price) if s.current_price else '...' }}</td>
-                            <td class="fw-bold">{{ "${:,.2f}".format(s.total_value) if s.total_value else '-' }}</td>
-                            <td class="{{ 'text-profit' if s.unrealised is not none and s.unrealised >= 0 else 'text-loss' }}">{{ "{:,.2f}%".format(s.pct_change) if s.pct_change is not none else '-' }}</td>
-                            <td><button class="btn btn-sm btn-outline-danger" onclick="openSell('{{ s.symbol }}', {{ s.qty }}, {{ s.current_price or 0 }})">Sell</button></td>
+                            <td>...</td>
+                            <td class="fw-bold">-</td>
+                            <td>-</td>
+                            <td><button class="btn btn-sm btn-outline-danger" onclick="openSell('{{ s.symbol }}', {{ s.qty }}, 0)">Sell</button></td>
                         </tr>
                         {% endfor %}
                     </tbody>
@@ -199,95 +211,217 @@ DASHBOARD_PAGE = BASE_LAYOUT.replace("{% block content %}{% endblock %}", """
 
 <h5 class="mb-3 text-secondary">Total Performance (Lifetime)</h5>
 <div class="row mb-5 text-center">
-    <div class="col-md-3 mb-3"><div class="card p-4 h-100 border-start border-4 {{ 'border-success' if totals.growth >= 0 else 'border-danger' }}"><div class="metric-label">Total Growth ($)</div><div class="metric-value {{ 'text-profit' if totals.growth >= 0 else 'text-loss' }}">${{ "{:,.2f}".format(totals.growth) }}</div></div></div>
-    <div class="col-md-3 mb-3"><div class="card p-4 h-100 border-start border-4 {{ 'border-success' if totals.realized >= 0 else 'border-danger' }}"><div class="metric-label">Realized Profit</div><div class="metric-value {{ 'text-profit' if totals.realized >= 0 else 'text-loss' }}">${{ "{:,.2f}".format(totals.realized) }}</div></div></div>
+    <div class="col-md-3 mb-3"><div class="card p-4 h-100 border-start border-4" data-metric-card="growth"><div class="metric-label">Total Growth ($)</div><div class="metric-value" data-metric="growth" data-format="money">...</div></div></div>
+    <div class="col-md-3 mb-3"><div class="card p-4 h-100 border-start border-4 {{ 'border-success' if stats.realized >= 0 else 'border-danger' }}" data-metric-card="realized"><div class="metric-label">Realized Profit</div><div class="metric-value {{ 'text-profit' if stats.realized >= 0 else 'text-loss' }}" data-metric="realized" data-format="money">${{ "{:,.2f}".format(stats.realized) }}</div></div></div>
 
     <div class="col-md-3 mb-3">
         <div class="card p-4 h-100 border-start border-4 border-info">
             <div class="metric-label">Trader Win Rate</div>
-            <div class="metric-value text-primary">{{ "{:,.0f}".format(totals.win_rate) }}%</div>
-            <div class="small text-muted">{{ totals.total_trades }} closed trades</div>
+            <div class="metric-value text-primary">{{ "{:,.0f}".format(stats.win_rate) }}%</div>
+            <div class="small text-muted">{{ stats.total_sells }} closed trades</div>
         </div>
     </div>
 
-    <div class="col-md-3 mb-3"><div class="card p-4 h-100 border-start border-4 {{ 'border-success' if totals.growth_pct >= 0 else 'border-danger' }}"><div class="metric-label">Total Growth (%)</div><div class="metric-value {{ 'text-profit' if totals.growth_pct >= 0 else 'text-loss' }}">{{ "{:,.2f}".format(totals.growth_pct) }}%</div></div></div>
+    <div class="col-md-3 mb-3"><div class="card p-4 h-100 border-start border-4" data-metric-card="growth_pct"><div class="metric-label">Total Growth (%)</div><div class="metric-value" data-metric="growth_pct" data-format="pct">...</div></div></div>
+</div>
+
+<div class="row mb-4">
+    <div class="col-12">
+        <div class="card p-4">
+            <h5 class="mb-3">Value Over Time</h5>
+            <div style="height: 300px; position: relative;">
+                <canvas id="historyChart"></canvas>
+            </div>
+            <p class="text-muted small mb-0" id="historyStatus">Loading history...</p>
+        </div>
+    </div>
 </div>
 
 <div class="row">
     <div class="col-md-7 mb-4">
         <div class="card p-4 h-100">
             <h5 class="mb-4">Recent News by Holding</h5>
-            {% if news %}
-                <div style="max-height: 500px; overflow-y: auto; padding-right:10px;">
-                {% for symbol, articles in news.items() %}
-                    <div class="stock-header"><h6 class="fw-bold text-primary">{{ symbol }}</h6></div>
-                    <ul class="list-group list-group-flush mb-4">
-                    {% for n in articles %}
-                        <li class="list-group-item px-0 border-0 pb-3">
-                            <a href="{{ n.link }}" target="_blank" class="news-link">{{ n.title }}</a>
-                            <div class="small text-muted mt-1 d-flex justify-content-between"><span>{{ n.publisher }}</span><span>{{ n.time }}</span></div>
-                        </li>
-                    {% endfor %}
-                    </ul>
-                {% endfor %}
-                </div>
-            {% else %}
-                <p class="text-muted">No news articles found for your holdings right now.</p>
-            {% endif %}
+            <div id="newsPanel" style="max-height: 500px; overflow-y: auto; padding-right:10px;">
+                <p class="text-muted">Loading news...</p>
+            </div>
         </div>
     </div>
 
     <div class="col-md-5 mb-4">
         <div class="card p-4 h-100">
             <h5 class="mb-3">Transaction History</h5>
-            <div style="max-height: 500px; overflow-y: auto;">
+            <form id="historyFilters" class="row g-2 mb-3">
+                <div class="col-4"><input name="symbol" class="form-control form-control-sm" placeholder="Symbol" style="text-transform:uppercase"></div>
+                <div class="col-4"><select name="type" class="form-select form-select-sm"><option value="">All</option><option value="BUY">Buy</option><option value="SELL">Sell</option></select></div>
+                <div class="col-4"><button class="btn btn-sm btn-outline-secondary w-100">Filter</button></div>
+                <div class="col-6"><input name="start" type="date" class="form-control form-control-sm"></div>
+                <div class="col-6"><input name="end" type="date" class="form-control form-control-sm"></div>
+            </form>
+            <div id="historyScroll" style="max-height: 500px; overflow-y: auto;">
                 <table class="table table-sm table-striped">
                     <thead><tr><th>Date</th><th>Type</th><th>Sym</th><th>Price</th><th>P/L</th></tr></thead>
-                    <tbody>
-                        {% for r in history|reverse %}
-                        <tr>
-                            <td>{{ r.date.split(' ')[0] }}</td>
-                            <td><span class="badge {{ 'bg-success' if r.type=='SELL' else 'bg-primary' }}">{{ r.type }}</span></td>
-                            <td class="fw-bold">{{ r.symbol }}</td>
-                            <td>${{ "{:,.2f}".format(r.price) }}</td>
-                            <td class="{{ 'text-profit' if r.realized_gain and r.realized_gain>=0 else 'text-loss' }}">
-                                {{ "${:,.0f}".format(r.realized_gain) if r.realized_gain is not none else '-' }}
-                            </td>
-                        </tr>
-                        {% endfor %}
+                    <tbody id="historyBody">
+                        {{ history_rows }}
                     </tbody>
                 </table>
+                <div id="historyMore" class="text-center text-muted small py-2" data-next="{{ history_next or '' }}"></div>
             </div>
         </div>
     </div>
 </div>
 
 <div class="modal fade" id="buyModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form method="POST" action="{{ url_for('trade') }}"><div class="modal-body"><input type="hidden" name="action" value="buy"><div class="mb-3"><label>Symbol</label><input name="symbol" class="form-control" required style="text-transform:uppercase"></div><div class="mb-3"><label>Qty</label><input name="qty" type="number" step="any" min="0.0001" class="form-control" required></div><div class="mb-3"><label>Price</label><input name="price" type="number" step="any" min="0.01" class="form-control" required></div></div><div class="modal-footer"><button class="btn btn-primary">Buy</button></div></form></div></div></div>
-<div class="modal fade" id="sellModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form method="POST" action="{{ url_for('trade') }}"><div class="modal-body"><input type="hidden" name="action" value="sell"><div class="mb-3"><label>Symbol</label><input name="symbol" id="sellSym" class="form-control" readonly></div><div class="mb-3"><label>Qty</label><input name="qty" id="sellQty" type="number" step="any" min="0.0001" class="form-control" required></div><div class="mb-3"><label>Price</label><input name="price" id="sellPrice" type="number" step="any" min="0.01" class="form-control" required></div></div><div class="modal-footer"><button class="btn btn-danger">Sell</button></div></form></div></div></div>
+<div class="modal fade" id="sellModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form method="POST" action="{{ url_for('trade') }}"><div class="modal-body"><input type="hidden" name="action" value="sell"><div class="mb-3"><label>Symbol</label><input name="symbol" id="sellSym" class="form-control" readonly></div><div class="mb-3"><label>Qty</label><input name="qty" id="sellQty" type="number" step="any" min="0.0001" class="form-control" required></div><div class="mb-3"><label>Price</label><input name="price" id="sellPrice" type="number" step="any" min="0.01" class="form-control" required></div><div class="mb-3"><label>Lot # <span class="text-muted small">(optional, sells from a specific lot)</span></label><input name="lot_id" type="number" step="1" min="0" class="form-control"></div></div><div class="modal-footer"><button class="btn btn-danger">Sell</button></div></form></div></div></div>
 
 <script>
-function openSell(s,q,p){document.getElementById('sellSym').value=s;document.getElementById('sellQty').value=q;if(p>0)document.getElementById('sellPrice').value=p;new bootstrap.Modal(document.getElementById('sellModal')).show();}
+function renderNews(data){
+    document.getElementById('newsPanel').innerHTML = data.html;
+}
 
-document.addEventListener("DOMContentLoaded", function() {
-    var ctx = document.getElementById('portfolioChart').getContext('2d');
-    var chartLabels = {{ chart_labels|tojson }};
-    var chartData = {{ chart_data|tojson }};
-
-    if(chartData.length === 0) {
-        chartLabels = ["No Data"];
-        chartData = [100];
-        var bgColors = ['#e5e7eb'];
-    } else {
-        var bgColors = ['#10b981', '#3b82f6', '#f59e0b', '#ef4444', '#8b5cf6', '#6366f1', '#ec4899', '#14b8a6', '#f97316', '#06b6d4', '#84cc16', '#d946ef', '#64748b', '#a855f7', '#fbbf24'];
+function loadNews(attempt){
+    fetch("{{ url_for('api_news') }}", {credentials: 'same-origin'})
+        .then(function(r) { return r.json(); })
+        .then(function(data) {
+            renderNews(data);
+            if(data.pending && data.pending.length && attempt < 3) setTimeout(function() { loadNews(attempt + 1); }, 3000);
+        })
+        .catch(function() { document.getElementById('newsPanel').innerHTML = '<p class="text-muted">News is unavailable right now.</p>'; });
+}
+
+var historyLoading = false;
+
+function historyQuery() {
+    var params = new URLSearchParams(new FormData(document.getElementById('historyFilters')));
+    Array.from(params.keys()).forEach(function(k) { if(!params.get(k)) params.delete(k); });
+    if(params.has('symbol')) params.set('symbol', params.get('symbol').toUpperCase());
+    return params;
+}
+
+function loadHistoryPage(reset) {
+    var more = document.getElementById('historyMore');
+    var params = historyQuery();
+    if(!reset) {
+        if(historyLoading || !more.dataset.next) return;
+        params.set('cursor', more.dataset.next);
     }
+    historyLoading = true;
+    more.textContent = 'Loading...';
+    fetch("{{ url_for('api_history') }}?" + params.toString(), {credentials: 'same-origin'})
+        .then(function(r) { return r.json(); })
+        .then(function(data) {
+            var body = document.getElementById('historyBody');
+            if(data.error) {
+                more.dataset.next = '';
+                more.textContent = data.error;
+                return;
+            }
+            if(reset) body.innerHTML = '';
+            body.insertAdjacentHTML('beforeend', data.html);
+            more.dataset.next = data.next || '';
+            more.textContent = (!data.next && body.children.length === 0) ? 'No transactions found.' : '';
+        })
+        .catch(function() { more.textContent = 'History unavailable.'; })
+        .finally(function() { historyLoading = false; });
+}
+
+function openSell(s,q,p){document.getElementById('sellSym').value=s;document.getElementById('sellQty').value=q;if(p>0)document.getElementById('sellPrice').value=p;new bootstrap.Modal(document.getElementById('sellModal')).show();}
+
+var portfolioChart = null;
+var chartColors = ['#10b981', '#3b82f6', '#f59e0b', '#ef4444', '#8b5cf6', '#6366f1', '#ec4899', '#14b8a6', '#f97316', '#06b6d4', '#84cc16', '#d946ef', '#64748b', '#a855f7', '#fbbf24'];
+
+function fmtNum(v, digits) {
+    return Number(v).toLocaleString('en-US', {minimumFractionDigits: digits, maximumFractionDigits: digits});
+}
+
+function fmtMoney(v, digits) {
+    return (v < 0 ? '-$' : '$') + fmtNum(Math.abs(v), digits === undefined ? 2 : digits);
+}
+
+function renderTotals(totals) {
+    document.querySelectorAll('[data-metric]').forEach(function(el) {
+        var v = totals[el.dataset.metric];
+        if(v === undefined || v === null) return;
+        el.textContent = el.dataset.format === 'pct' ? fmtNum(v, 2) + '%' : fmtMoney(v);
+        if(!el.dataset.unsigned) {
+            el.classList.toggle('text-profit', v >= 0);
+            el.classList.toggle('text-loss', v < 0);
+        }
+    });
+    document.querySelectorAll('[data-metric-card]').forEach(function(el) {
+        var v = totals[el.dataset.metricCard];
+        if(v === undefined || v === null) return;
+        el.classList.toggle('border-success', v >= 0);
+        el.classList.toggle('border-danger', v < 0);
+    });
+}
 
-    new Chart(ctx, {
+var priceBadges = {
+    stale: ['bg-warning text-dark', 'stale', 'Price service unreachable; last known price'],
+    not_found: ['bg-secondary', 'no data', 'No quote for this symbol. It may be delisted or mistyped.'],
+    unavailable: ['bg-danger', 'unavailable', 'Price service unreachable and no earlier price is cached.']
+};
+
+function priceBadge(s) {
+    var b = priceBadges[s.price_status], span = document.createElement('span');
+    span.className = 'badge ms-1 ' + b[0];
+    span.textContent = b[1];
+    span.title = b[2] + (s.price_as_of ? ' from ' + s.price_as_of.replace('T', ' ') : '');
+    return span;
+}
+
+function renderHoldings(holdings) {
+    var body = document.getElementById('holdingsBody');
+    body.innerHTML = '';
+    holdings.forEach(function(s) {
+        var tr = document.createElement('tr');
+        var cells = [
+            s.symbol,
+            fmtNum(s.qty, 4),
+            fmtMoney(s.priceBought),
+            s.current_price ? fmtMoney(s.current_price) : '',
+            s.total_value ? fmtMoney(s.total_value) : '-',
+            s.pct_change !== null ? fmtNum(s.pct_change, 2) + '%' : '-'
+        ];
+        cells.forEach(function(text, i) {
+            var td = document.createElement('td');
+            td.textContent = text;
+            if(i === 0 || i === 4) td.className = 'fw-bold';
+            if(i === 5) td.className = (s.unrealised !== null && s.unrealised >= 0) ? 'text-profit' : 'text-loss';
+            if(i === 3 && priceBadges[s.price_status]) td.appendChild(priceBadge(s));
+            tr.appendChild(td);
+        });
+        var td = document.createElement('td');
+        var btn = document.createElement('button');
+        btn.className = 'btn btn-sm btn-outline-danger';
+        btn.textContent = 'Sell';
+        btn.addEventListener('click', function() { openSell(s.symbol, s.qty, s.current_price || 0); });
+        td.appendChild(btn);
+        tr.appendChild(td);
+        body.appendChild(tr);
+    });
+}
+
+function renderChart(chart) {
+    var labels = chart.labels, data = chart.data, colors = chartColors;
+    if(data.length === 0) {
+        labels = ["No Data"];
+        data = [100];
+        colors = ['#e5e7eb'];
+    }
+    if(portfolioChart) {
+        portfolioChart.data.labels = labels;
+        portfolioChart.data.datasets[0].data = data;
+        portfolioChart.data.datasets[0].backgroundColor = colors;
+        portfolioChart.update();
+        return;
+    }
+    portfolioChart = new Chart(document.getElementById('portfolioChart').getContext('2d'), {
         type: 'doughnut',
         data: {
-            labels: chartLabels,
+            labels: labels,
             datasets: [{
-                data: chartData,
-                backgroundColor: bgColors,
+                data: data,
+                backgroundColor: colors,
                 borderWidth: 0
             }]
         },
@@ -299,6 +433,130 @@ document.addEventListener("DOMContentLoaded", function() {
             }
         }
     });
+}
+
+function renderHistory(series) {
+    var status = document.getElementById('historyStatus');
+    if(series.dates.length === 0) { status.textContent = 'No trades yet.'; return; }
+    status.textContent = '';
+    new Chart(document.getElementById('historyChart').getContext('2d'), {
+        type: 'line',
+        data: {
+            labels: series.dates,
+            datasets: [
+                {label: 'Value', data: series.value, borderColor: '#3b82f6', pointRadius: 0, borderWidth: 2},
+                {label: 'Cost Basis', data: series.cost_basis, borderColor: '#64748b', pointRadius: 0, borderWidth: 1, borderDash: [4, 4]},
+                {label: 'Realized P/L', data: series.realized, borderColor: '#10b981', pointRadius: 0, borderWidth: 1, hidden: true},
+                {label: 'Unrealized P/L', data: series.unrealized, borderColor: '#f59e0b', pointRadius: 0, borderWidth: 1, hidden: true}
+            ]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            animation: false,
+            interaction: { mode: 'index', intersect: false },
+            scales: { x: { ticks: { maxTicksLimit: 12 } } },
+            plugins: { legend: { position: 'bottom' } }
+        }
+    });
+}
+
+function loadHistory() {
+    fetch("{{ url_for('api_portfolio_history') }}", {credentials: 'same-origin'})
+        .then(function(r) { return r.json(); })
+        .then(renderHistory)
+        .catch(function() { document.getElementById('historyStatus').textContent = 'History unavailable.'; });
+}
+
+function renderPortfolio(data) {
+    renderTotals(data.totals);
+    renderHoldings(data.holdings);
+    renderChart(data.chart);
+    var asOf = 'as of ' + data.as_of.replace('T', ' '), t = data.totals;
+    if(t.stale_prices || t.missing_prices) {
+        asOf += ' (' + [t.stale_prices ? t.stale_prices + ' stale' : '', t.missing_prices ? t.missing_prices + ' unpriced' : '']
+            .filter(Boolean).join(', ') + ')';
+    }
+    document.getElementById('asOf').textContent = asOf;
+}
+
+function loadPortfolio() {
+    fetch("{{ url_for('api_portfolio') }}", {credentials: 'same-origin'})
+        .then(function(r) { return r.json(); })
+        .then(renderPortfolio)
+        .catch(function() { document.getElementById('asOf').textContent = 'prices unavailable'; });
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+    loadPortfolio();
+    loadNews(0);
+    loadHistory();
+    document.getElementById('historyFilters').addEventListener('submit', function(e) {
+        e.preventDefault();
+        loadHistoryPage(true);
+    });
+    if(window.IntersectionObserver) {
+        new IntersectionObserver(function(entries) {
+            if(entries[0].isIntersecting) loadHistoryPage(false);
+        }, {root: document.getElementById('historyScroll')}).observe(document.getElementById('historyMore'));
+    } else {
+        document.getElementById('historyScroll').addEventListener('scroll', function() {
+            if(this.scrollTop + this.clientHeight >= this.scrollHeight - 50) loadHistoryPage(false);
+        });
+    }
+    var polling = false;
+    function poll() {
+        if(polling) return;
+        polling = true;
+        setInterval(function() { if(!document.hidden) loadPortfolio(); }, 60000);
+    }
+    if(window.EventSource) {
+        var stream = new EventSource("{{ url_for('api_stream') }}");
+        stream.addEventListener('portfolio', function(e) { renderPortfolio(JSON.parse(e.data)); });
+        // The browser gives up on a 429 or 503 (too many open streams); keep the page fresh by polling instead.
+        stream.addEventListener('error', function() { if(stream.readyState === EventSource.CLOSED) poll(); });
+    } else {
+        poll();
+    }
 });
 </script>
-""")
\ No newline at end of file
+""")
+
+HISTORY_ROWS = """
+{% for r in history %}
+<tr>
+    <td>{{ r.date.split(' ')[0] }}</td>
+    <td><span class="badge {{ 'bg-success' if r.type=='SELL' else 'bg-primary' }}">{{ r.type }}</span></td>
+    <td class="fw-bold">{{ r.symbol }}</td>
+    <td>${{ "{:,.2f}".format(r.price) }}</td>
+    <td class="{{ 'text-profit' if r.realized_gain and r.realized_gain>=0 else 'text-loss' }}">
+        {{ "${:,.0f}".format(r.realized_gain) if r.realized_gain is not none else '-' }}
+    </td>
+</tr>
+{% endfor %}
+"""
+
+NEWS_PANEL = """
+{% for symbol, items in news.items() %}
+<div class="stock-header"><h6 class="fw-bold text-primary">{{ symbol }}</h6></div>
+<ul class="list-group list-group-flush mb-4">
+    {% for n in items %}
+    <li class="list-group-item px-0 border-0 pb-3">
+        <a target="_blank" class="news-link" href="{{ n.link }}">{{ n.title }}</a>
+        <div class="small text-muted mt-1 d-flex justify-content-between"><span>{{ n.publisher or '' }}</span><span>{{ n.time or '' }}</span></div>
+    </li>
+    {% endfor %}
+</ul>
+{% else %}
+<p class="text-muted">{{ 'Loading news...' if pending else 'No news articles found for your holdings right now.' }}</p>
+{% endfor %}
+"""
+
+TEMPLATES = {
+    'login.html': LOGIN_PAGE,
+    'register.html': REGISTER_PAGE,
+    'settings.html': SETTINGS_PAGE,
+    'dashboard.html': DASHBOARD_PAGE,
+    'history_rows.html': HISTORY_ROWS,
+    'news_panel.html': NEWS_PANEL,
+}
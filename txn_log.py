@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _decode(line):
+    line = line.strip()
+    if not line: return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def append(path, records):
+    payload = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records).encode()
+    if not payload: return
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        size = os.fstat(fd).st_size
+        if size:
+            with open(path, 'rb') as f:
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    payload = b'\n' + payload
+        os.write(fd, payload)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def iter_records(path):
+    if not os.path.exists(path): return
+    with open(path, 'rb') as f:
+        for line in f:
+            record = _decode(line)
+            if record is not None:
+                yield record
+
+
+def scan_reverse(path, end=None):
+    # Yields (offset, raw line) newest first, reading only the blocks before `end`.
+    if not os.path.exists(path): return
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        pos = size if end is None else min(end, size)
+        tail = b''
+        while pos > 0:
+            step = min(BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + tail
+            lines = buf.split(b'\n')
+            tail = lines.pop(0)
+            offset = pos + len(buf)
+            for line in reversed(lines):
+                offset -= len(line)
+                yield offset, line
+                offset -= 1
+        yield 0, tail
+
+
+def iter_reverse(path):
+    for _, line in scan_reverse(path):
+        record = _decode(line)
+        if record is not None:
+            yield record
+
+
+def page(path, end, limit, match=None, needle=None):
+    records, offset = [], 0
+    for offset, line in scan_reverse(path, end):
+        if needle and needle not in line: continue
+        record = _decode(line)
+        if record is None or (match and not match(record)): continue
+        records.append(record)
+        if len(records) >= limit:
+            return records, (offset if offset > 0 else None)
+    return records, None
+
+
+def tail(path, n):
+    out = []
+    for record in iter_reverse(path):
+        if len(out) >= n: break
+        out.append(record)
+    out.reverse()
+    return out
+
+
+def read(path):
+    records, damaged = [], 0
+    if not os.path.exists(path): return records, damaged
+    with open(path, 'rb') as f:
+        for line in f:
+            record = _decode(line)
+            if record is not None:
+                records.append(record)
+            elif line.strip():
+                damaged += 1
+    return records, damaged
+
+
+def rewrite(path, records):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as f:
+        for r in records:
+            f.write(json.dumps(r, separators=(',', ':')) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
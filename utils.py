@@ -1,91 +1,443 @@
-import requests
+import http_client
+import threading
+import time
 import concurrent.futures
+from collections import OrderedDict
 from datetime import datetime
-from config import PUSHOVER_APP_TOKEN
+from metrics import timed
+from config import (PUSHOVER_APP_TOKEN, PUSHOVER_API_URL, MARKET_OPEN, MARKET_CLOSE, US_EASTERN,
+                    QUOTE_CACHE_SIZE, QUOTE_TTL_OPEN, QUOTE_TTL_CLOSED, QUOTE_NEGATIVE_TTL, QUOTE_BATCH_SIZE,
+                    YAHOO_QUERY1_URL, YAHOO_QUERY2_URL, NEWS_TTL, NEWS_CACHE_SIZE)
 
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+
+CHART_PARAMS = {'interval': '1d', 'range': '1d'}
+
+
+def spark_params(symbols):
+    return dict(CHART_PARAMS, symbols=','.join(symbols))
+
+# Yahoo answered but has no price for the symbol (delisted or mistyped). None means the lookup itself failed.
+NO_DATA = False
+
+
+def parse_spark(data, symbols):
+    price_map = {}
+    wanted = {sym.upper(): sym for sym in symbols}
+    for item in (data.get('spark') or {}).get('result') or []:
+        sym = wanted.get((item.get('symbol') or '').upper())
+        prices = _chart_prices((item.get('response') or [None])[0])
+        if sym and prices:
+            price_map[sym] = prices
+    return price_map
+
+
+def parse_chart(data):
+    if 'chart' in data and 'result' in data['chart'] and data['chart']['result']:
+        return _chart_prices(data['chart']['result'][0])
+    return None
+
+
+def _chart_prices(result):
+    if result and 'meta' in result:
+        current = result['meta'].get('regularMarketPrice')
+        prev = result['meta'].get('previousClose') or result['meta'].get('chartPreviousClose')
+        if not prev and 'indicators' in result and 'quote' in result['indicators']:
+            quotes = result['indicators']['quote'][0]
+            if 'close' in quotes and quotes['close'] and len(quotes['close']) >= 2:
+                prev = quotes['close'][-2]
+        if current:
+            return {'price': current, 'prev': prev}
+    return None
+
+
+def parse_news(data):
+    clean_news = []
+    for n in data.get('news') or []:
+        pub_time = n.get('providerPublishTime', 0)
+        clean_news.append({
+            'title': n.get('title'),
+            'link': n.get('link'),
+            'publisher': n.get('publisher'),
+            'time': datetime.fromtimestamp(pub_time).strftime('%Y-%m-%d')
+        })
+    return clean_news
+
+
+class _Flight:
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class QuoteCache:
+
+    def __init__(self, max_size=QUOTE_CACHE_SIZE, ttl_open=QUOTE_TTL_OPEN, ttl_closed=QUOTE_TTL_CLOSED,
+                 negative_ttl=QUOTE_NEGATIVE_TTL):
+        self.max_size = max_size
+        self.ttl_open = ttl_open
+        self.ttl_closed = ttl_closed
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = self.misses = self.evictions = self.stale_served = 0
+
+    def ttl(self):
+        now = datetime.now(US_EASTERN)
+        if now.weekday() < 5 and MARKET_OPEN <= now.time() <= MARKET_CLOSE:
+            return self.ttl_open
+        return self.ttl_closed
+
+    def get_many(self, symbols, loader, wait_timeout=15):
+        result, owned, waiting = {}, {}, {}
+        now = time.monotonic()
+        with self._lock:
+            for sym in symbols:
+                entry = self._entries.get(sym)
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(sym)
+                    self.hits += 1
+                    if entry[1]: result[sym] = entry[1]
+                    continue
+                self.misses += 1
+                if sym in self._inflight:
+                    waiting[sym] = self._inflight[sym]
+                else:
+                    owned[sym] = self._inflight[sym] = _Flight()
+        if owned:
+            fetched = {}
+            try:
+                fetched = loader(list(owned))
+            finally:
+                self._store(owned, fetched)
+            result.update({sym: data for sym, data in fetched.items() if data})
+        for sym, flight in waiting.items():
+            if flight.event.wait(wait_timeout) and flight.result:
+                result[sym] = flight.result
+        result.update(self.last_known([sym for sym in symbols if sym not in result]))
+        return result
+
+    def last_known(self, symbols):
+        # Expired quotes are kept until evicted so a failed refresh can still show the last price, marked stale.
+        stale = {}
+        with self._lock:
+            for sym in symbols:
+                entry = self._entries.get(sym)
+                if entry and entry[1]:
+                    as_of = datetime.fromtimestamp(entry[2], US_EASTERN).isoformat(timespec='seconds')
+                    stale[sym] = dict(entry[1], stale=True, as_of=as_of)
+            self.stale_served += len(stale)
+        return stale
+
+    def not_found(self, symbols):
+        now = time.monotonic()
+        with self._lock:
+            return {sym for sym in symbols
+                    if (entry := self._entries.get(sym)) and entry[1] is NO_DATA and entry[0] > now}
+
+    def lookup(self, symbols):
+        # Non-blocking read for the async path, which does its own single-flight.
+        result, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for sym in symbols:
+                entry = self._entries.get(sym)
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(sym)
+                    self.hits += 1
+                    if entry[1]: result[sym] = entry[1]
+                else:
+                    self.misses += 1
+                    missing.append(sym)
+        return result, missing
+
+    def put_many(self, fetched):
+        expires = time.monotonic() + self.ttl()
+        with self._lock:
+            self._put(fetched, expires)
+
+    def _put(self, fetched, expires):
+        stamp = time.time()
+        for sym, data in fetched.items():
+            if data:
+                self._entries[sym] = (expires, data, stamp)
+            elif data is NO_DATA:
+                self._entries[sym] = (time.monotonic() + self.negative_ttl, NO_DATA, stamp)
+            else:
+                continue
+            self._entries.move_to_end(sym)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _store(self, flights, fetched):
+        expires = time.monotonic() + self.ttl()
+        with self._lock:
+            for sym, flight in flights.items():
+                flight.result = fetched.get(sym)
+                self._inflight.pop(sym, None)
+                flight.event.set()
+            self._put({sym: fetched.get(sym) for sym in flights}, expires)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'stale_served': self.stale_served,
+                'hit_ratio': (self.hits / lookups) if lookups else 0,
+                'size': len(self._entries),
+                'not_found': sum(1 for entry in self._entries.values() if entry[1] is NO_DATA),
+                'max_size': self.max_size,
+                'inflight': len(self._inflight),
+                'ttl': self.ttl()
+            }
+
+
+quote_cache = QuoteCache()
+
+
+class QuoteProvider:
+    def fetch(self, symbols):
+        raise NotImplementedError
+
+
+class YahooQuoteProvider(QuoteProvider):
+    def __init__(self, base_url=YAHOO_QUERY1_URL, chunk_size=QUOTE_BATCH_SIZE, max_workers=10):
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = max(1, chunk_size)
+        self.max_workers = max_workers
+
+    def fetch(self, symbols):
+        symbols = list(symbols)
+        if not symbols: return {}
+        price_map = {}
+        chunks = [symbols[i:i + self.chunk_size] for i in range(0, len(symbols), self.chunk_size)]
+        for batch in self._run(self.fetch_batch, chunks):
+            price_map.update(batch)
+        missing = [sym for sym in symbols if sym not in price_map]
+        for sym, data in self._run(self.fetch_chart, missing):
+            if data is not None:
+                price_map[sym] = data
+        return price_map
+
+    def _run(self, fn, items):
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            for future in concurrent.futures.as_completed([executor.submit(fn, item) for item in items]):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Thread error: {e}")
+        return results
+
+    def fetch_batch(self, symbols):
+        # /v7/finance/quote now wants a session cookie and crumb and answers 401 without them; spark returns the
+        # same chart data as the per-symbol fallback for several symbols at once and needs neither.
+        try:
+            url = f"{self.base_url}/v7/finance/spark"
+            response = http_client.get(url, headers=BROWSER_HEADERS, params=spark_params(symbols))
+            if response.status_code == 200:
+                return parse_spark(response.json(), symbols)
+            print(f"Error batch price ({response.status_code}) for {len(symbols)} symbols: {response.text[:200]}")
+        except http_client.CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"Error batch price {','.join(symbols)}: {e}")
+        return {}
+
+    def fetch_chart(self, symbol):
+        if not symbol: return None, None
+        try:
+            url = f"{self.base_url}/v8/finance/chart/{symbol}"
+            response = http_client.get(url, headers=BROWSER_HEADERS, params=CHART_PARAMS)
+            if response.status_code == 200:
+                return symbol, parse_chart(response.json()) or NO_DATA
+            if response.status_code == 404:
+                return symbol, NO_DATA
+        except http_client.CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"Error price {symbol}: {e}")
+        return symbol, None
+
+
+_quote_provider = YahooQuoteProvider()
+
+
+def get_quote_provider():
+    return _quote_provider
+
+def set_quote_provider(provider):
+    global _quote_provider
+    _quote_provider = provider
+    quote_cache.clear()
+
+def _fetch_uncached_prices(symbols):
+    return _quote_provider.fetch(symbols)
+
+@timed('quotes')
 def fetch_stock_price(symbol):
     if not symbol: return None, None
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
-        params = {'interval': '1d', 'range': '1d'}
-        response = requests.get(url, headers=headers, params=params, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if 'chart' in data and 'result' in data['chart'] and data['chart']['result']:
-                result = data['chart']['result'][0]
-                if 'meta' in result:
-                    current = result['meta'].get('regularMarketPrice')
-                    prev = result['meta'].get('previousClose') or result['meta'].get('chartPreviousClose')
-                    if not prev and 'indicators' in result and 'quote' in result['indicators']:
-                        quotes = result['indicators']['quote'][0]
-                        if 'close' in quotes and quotes['close'] and len(quotes['close']) >= 2:
-                            prev = quotes['close'][-2]
-                    if current:
-                        return symbol, {'price': current, 'prev': prev}
-    except Exception as e:
-        print(f"Error price {symbol}: {e}")
-    return symbol, None
+    return symbol, quote_cache.get_many([symbol], _fetch_uncached_prices).get(symbol)
 
+@timed('quotes')
 def fetch_batch_prices(symbols):
     if not symbols: return {}
-    price_map = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_symbol = {executor.submit(fetch_stock_price, sym): sym for sym in symbols}
-        for future in concurrent.futures.as_completed(future_to_symbol):
-            try:
-                sym, data = future.result()
-                if data:
-                    price_map[sym] = data
-            except Exception as e:
-                print(f"Thread error: {e}")
-    return price_map
+    return quote_cache.get_many(list(dict.fromkeys(symbols)), _fetch_uncached_prices)
 
-def fetch_stock_news_grouped(symbols):
-    if not symbols: return {}
-    news_map = {}
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    def get_single_news(symbol):
-        try:
-            url = f"https://query2.finance.yahoo.com/v1/finance/search?q={symbol}&newsCount=3"
-            resp = requests.get(url, headers=headers, timeout=5)
-            if resp.status_code == 200:
-                data = resp.json()
-                clean_news = []
-                if 'news' in data:
-                    for n in data['news']:
-                        pub_time = n.get('providerPublishTime', 0)
-                        clean_news.append({
-                            'title': n.get('title'),
-                            'link': n.get('link'),
-                            'publisher': n.get('publisher'),
-                            'time': datetime.fromtimestamp(pub_time).strftime('%Y-%m-%d')
-                        })
-                return symbol, clean_news
-        except:
-            return symbol, None
+def get_single_news(symbol):
+    try:
+        url = f"{YAHOO_QUERY2_URL}/v1/finance/search?q={symbol}&newsCount=3"
+        resp = http_client.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+        if resp.status_code == 200:
+            return symbol, parse_news(resp.json())
+    except:
         return symbol, None
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_url = {executor.submit(get_single_news, sym): sym for sym in symbols}
-        for future in concurrent.futures.as_completed(future_to_url):
-            try:
-                sym, news_items = future.result()
-                if news_items:
-                    news_map[sym] = news_items
-            except:
-                pass
+    return symbol, None
+
+
+class NewsCache:
+    def __init__(self, ttl=NEWS_TTL, max_size=NEWS_CACHE_SIZE, max_workers=5):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='news')
+        self.hits = self.misses = self.refreshes = 0
+
+    def _lookup(self, symbols):
+        news_map, due = {}, []
+        now = time.monotonic()
+        for sym in symbols:
+            entry = self._entries.get(sym)
+            if entry:
+                self._entries.move_to_end(sym)
+                if entry[1]:
+                    news_map[sym] = entry[1]
+                if entry[0] + self.ttl > now:
+                    self.hits += 1
+                    continue
+            self.misses += 1
+            due.append((sym, entry is None))
+        return news_map, due
+
+    def lookup(self, symbols):
+        # Returns cached news plus (symbol, never_fetched) pairs that are missing or stale.
+        with self._lock:
+            return self._lookup(symbols)
+
+    @timed('news')
+    def get_many(self, symbols, wait=None):
+        missing = {}
+        with self._lock:
+            news_map, due = self._lookup(symbols)
+            for sym, new in due:
+                future = self._schedule(sym)
+                if new:
+                    missing[sym] = future
+        if wait and missing:
+            done, _ = concurrent.futures.wait(list(missing.values()), timeout=wait)
+            for future in done:
+                sym, items = future.result()
+                if items:
+                    news_map[sym] = items
+        pending = [sym for sym, future in missing.items() if not future.done()]
+        return news_map, pending
+
+    def prefetch(self, symbols):
+        self.get_many(symbols)
+
+    def stamps(self, symbols):
+        with self._lock:
+            return tuple(self._entries[sym][0] if sym in self._entries else None for sym in symbols)
+
+    def _schedule(self, sym):
+        future = self._refreshing.get(sym)
+        if future is None:
+            self.refreshes += 1
+            future = self._refreshing[sym] = self._executor.submit(self._refresh, sym)
+        return future
+
+    def _refresh(self, sym):
+        try:
+            sym, items = get_single_news(sym)
+        except Exception as e:
+            print(f"News refresh error {sym}: {e}")
+            items = None
+        with self._lock:
+            self._refreshing.pop(sym, None)
+            self._put(sym, items)
+        return sym, items
+
+    def put(self, sym, items):
+        with self._lock:
+            self._put(sym, items)
+
+    def _put(self, sym, items):
+        # A failed refresh keeps the old items; a symbol never fetched gets an empty entry so it is not retried at once.
+        if items is not None or sym not in self._entries:
+            self._entries[sym] = (time.monotonic(), items or [])
+            self._entries.move_to_end(sym)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'hit_ratio': (self.hits / lookups) if lookups else 0,
+                'size': len(self._entries),
+                'refreshing': len(self._refreshing),
+                'queued': self._executor._work_queue.qsize(),
+                'workers': len(self._executor._threads)
+            }
+
+
+news_cache = NewsCache()
+
+
+def fetch_stock_news_grouped(symbols, wait=5):
+    if not symbols: return {}
+    news_map, _ = news_cache.get_many(symbols, wait=wait)
     return news_map
 
+def post_pushover(user_key, message, url=None):
+    return http_client.post(url or PUSHOVER_API_URL, data={
+        "token": PUSHOVER_APP_TOKEN,
+        "user": user_key,
+        "message": message
+    }, timeout=10)
+
+def pushover_accepted(response):
+    if response.status_code != 200: return False
+    try:
+        return response.json().get('status') == 1
+    except ValueError:
+        return False
+
 def send_pushover(user_key, message):
     if not user_key: return False
     try:
-        requests.post("https://api.pushover.net/1/messages.json", data={
-            "token": PUSHOVER_APP_TOKEN,
-            "user": user_key,
-            "message": message
-        })
-        return True
-    except:
-        return False
\ No newline at end of file
+        return pushover_accepted(post_pushover(user_key, message))
+    except Exception as e:
+        print(f"Pushover error: {e}")
+        return False
@@ -0,0 +1,164 @@
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from config import VALUATION_CACHE_SIZE, PRICE_REFRESH_RETRY
+from price_store import price_store, to_day, from_day
+
+
+def _txn_day(txn):
+    return to_day(date.fromisoformat(str(txn['date'])[:10]))
+
+
+def _forward_fill(matrix):
+    valid = ~np.isnan(matrix)
+    idx = np.where(valid, np.arange(matrix.shape[0])[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = matrix[idx, np.arange(matrix.shape[1])]
+    filled[~np.maximum.accumulate(valid, axis=0)] = np.nan
+    return filled
+
+
+def portfolio_series(history, store=price_store, end_day=None):
+    txns = [t for t in history if t.get('type') in ('BUY', 'SELL')]
+    if not txns:
+        return {'dates': [], 'value': [], 'cost_basis': [], 'realized': [], 'unrealized': [], 'symbols': []}
+
+    symbols = sorted({t['symbol'] for t in txns})
+    sym_idx = {s: i for i, s in enumerate(symbols)}
+    t_day = np.fromiter((_txn_day(t) for t in txns), dtype=np.int64, count=len(txns))
+    t_sym = np.fromiter((sym_idx[t['symbol']] for t in txns), dtype=np.int64, count=len(txns))
+    t_qty = np.fromiter((float(t['qty']) for t in txns), dtype=np.float64, count=len(txns))
+    t_price = np.fromiter((float(t['price']) for t in txns), dtype=np.float64, count=len(txns))
+    t_gain = np.fromiter((float(t.get('realized_gain') or 0) for t in txns), dtype=np.float64, count=len(txns))
+    is_sell = np.fromiter((t['type'] == 'SELL' for t in txns), dtype=bool, count=len(txns))
+
+    # Business-day grid from the first trade to today.
+    end_day = end_day if end_day is not None else to_day(date.today())
+    start, end = np.datetime64(from_day(t_day.min())), np.datetime64(from_day(max(end_day, t_day.max()) + 1))
+    grid = np.arange(start, end, dtype='datetime64[D]')
+    # Weekend trades keep their own row so a position never appears before it was opened.
+    grid = np.union1d(grid[np.is_busday(grid)].astype(np.int64), t_day)
+    row = np.minimum(np.searchsorted(grid, t_day, side='left'), len(grid) - 1)
+
+    shape = (len(grid), len(symbols))
+    signed_qty = np.where(is_sell, -t_qty, t_qty)
+    # A sell removes qty * average cost, which is proceeds minus the realized gain already recorded.
+    cost_delta = np.where(is_sell, -(t_qty * t_price - t_gain), t_qty * t_price)
+
+    qty = np.zeros(shape)
+    np.add.at(qty, (row, t_sym), signed_qty)
+    np.cumsum(qty, axis=0, out=qty)
+    qty[np.abs(qty) < 1e-9] = 0
+
+    cost = np.zeros(shape)
+    np.add.at(cost, (row, t_sym), cost_delta)
+    cost_basis = np.cumsum(cost.sum(axis=1))
+
+    realized = np.zeros(len(grid))
+    np.add.at(realized, row, np.where(is_sell, t_gain, 0))
+    np.cumsum(realized, out=realized)
+
+    closes = np.full(shape, np.nan)
+    for s, j in sym_idx.items():
+        bars = store.read(s, ('date', 'close'))
+        if len(bars['date']) == 0: continue
+        k = np.searchsorted(bars['date'], grid, side='right') - 1
+        ok = k >= 0
+        closes[ok, j] = np.asarray(bars['close'])[k[ok]]
+
+    # Days without a stored close fall back to the most recent trade price for that symbol.
+    gaps = np.isnan(closes) & (qty != 0)
+    if gaps.any():
+        cols = np.flatnonzero(gaps.any(axis=0))
+        trade_px = np.full((len(grid), len(cols)), np.nan)
+        pick = np.isin(t_sym, cols)
+        trade_px[row[pick], np.searchsorted(cols, t_sym[pick])] = t_price[pick]
+        closes[:, cols] = np.where(np.isnan(closes[:, cols]), _forward_fill(trade_px), closes[:, cols])
+
+    value = np.nansum(qty * closes, axis=1)
+    unrealized = value - cost_basis
+
+    return {
+        'dates': grid.astype('datetime64[D]').astype(str).tolist(),
+        'value': np.round(value, 2).tolist(),
+        'cost_basis': np.round(cost_basis, 2).tolist(),
+        'realized': np.round(realized, 2).tolist(),
+        'unrealized': np.round(unrealized, 2).tolist(),
+        'symbols': symbols
+    }
+
+
+def _stale_symbols(symbols, store):
+    # Symbols whose last stored close is older than the previous business day need a refresh.
+    prev = int(np.busday_offset(np.datetime64(date.today()), -1, roll='forward').astype(np.int64))
+    return [s for s in symbols if (store.last_day(s) or 0) < prev]
+
+
+class ValuationCache:
+    def __init__(self, max_size=VALUATION_CACHE_SIZE, store=price_store, retry=PRICE_REFRESH_RETRY):
+        self.max_size = max_size
+        self.store = store
+        self.retry = retry
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='prices')
+
+    def _price_key(self, symbols):
+        return tuple(self.store.last_day(s) for s in symbols)
+
+    def get(self, username, version, load_history):
+        today = to_day(date.today())
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry:
+                self._entries.move_to_end(username)
+        if entry and entry['version'] == version and entry['day'] == today:
+            if entry['prices'] == self._price_key(entry['series'].get('symbols', [])):
+                return entry['series']
+
+        history = load_history()
+        symbols = sorted({t['symbol'] for t in history if t.get('type') in ('BUY', 'SELL')})
+        self._schedule_refresh(_stale_symbols(symbols, self.store))
+        series = portfolio_series(history, self.store)
+        with self._lock:
+            self._entries[username] = {'version': version, 'day': today, 'prices': self._price_key(symbols),
+                                       'series': series}
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return series
+
+    def _schedule_refresh(self, symbols):
+        # Downloads happen off the request thread; the new closes change the price key, so the next request
+        # recomputes. Delisted symbols and holidays never catch up, hence the retry interval.
+        now = time.time()
+        due = [s for s in symbols if now - (self.store.last_attempt(s) or 0) >= self.retry]
+        with self._lock:
+            due = [s for s in due if s not in self._refreshing]
+            self._refreshing.update(due)
+        if due:
+            self._executor.submit(self._refresh, due)
+
+    def _refresh(self, symbols):
+        try:
+            self.store.update_many(symbols)
+        except Exception as e:
+            print(f"Price refresh error {','.join(symbols)}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.difference_update(symbols)
+
+    def invalidate(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'refreshing': len(self._refreshing)}
+
+
+valuation_cache = ValuationCache()